@@ -0,0 +1,110 @@
+"""
+OOB error curves of random forests, grown incrementally and cached.
+
+Each forest is grown with ``warm_start``: at every checkpoint only the new
+trees are fitted and the OOB error is recorded, so a whole curve costs one
+forest of the largest size. The configurations run concurrently in a process
+pool, and every curve is cached on disk under a hash of the dataset, the
+forest parameters, the checkpoints and the random state, so re-plotting is
+instant.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+RANDOM_STATE = 123
+
+CACHE_DIR = 'oob_cache'
+
+
+def dataset_hash(X, y):
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([str(col) for col in X.columns]).encode('utf-8'))
+    sha1.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    sha1.update(pd.util.hash_pandas_object(pd.Series(y), index=False).values.tobytes())
+    return sha1.hexdigest()
+
+
+def _cache_file(cache_dir, data_hash, params, checkpoints, random_state):
+    key = json.dumps({'data': data_hash, 'params': params,
+                      'checkpoints': list(checkpoints), 'random_state': random_state},
+                     sort_keys=True)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+# The (n_estimators, OOB error) pairs of one forest grown through
+# the (increasing) checkpoints
+def oob_curve(X, y, params, checkpoints, random_state=RANDOM_STATE):
+    clf = RandomForestClassifier(warm_start=True,
+                                 oob_score=True,
+                                 random_state=random_state,
+                                 **params)
+    curve = []
+    for n_estimators in checkpoints:
+        clf.set_params(n_estimators=n_estimators)
+        clf.fit(X, y)
+        curve.append((n_estimators, 1 - clf.oob_score_))
+
+    return curve
+
+
+# The dataset is sent to each worker once, when it starts
+_data = {}
+
+
+def _init_worker(X, y):
+    _data['X'], _data['y'] = X, y
+
+
+def _run(task):
+    params, checkpoints, random_state = task
+    return oob_curve(_data['X'], _data['y'], params, checkpoints, random_state)
+
+
+# Maps the label of each (label, params) configuration to its OOB
+# curve over the checkpoints. The curves that are not cached are
+# computed on up to n_jobs processes (all the cores by default).
+def oob_curves(X, y, configs, checkpoints, random_state=RANDOM_STATE,
+               n_jobs=None, cache_dir=CACHE_DIR):
+    checkpoints = sorted(checkpoints)
+    data_hash = dataset_hash(X, y)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    curves = OrderedDict()
+    missing = []
+    for label, params in configs:
+        filename = _cache_file(cache_dir, data_hash, params, checkpoints, random_state)
+        if os.path.isfile(filename):
+            with open(filename) as fin:
+                curves[label] = [tuple(point) for point in json.load(fin)]
+        else:
+            curves[label] = None
+            missing.append((label, params, filename))
+
+    if not missing:
+        return curves
+
+    tasks = [(params, checkpoints, random_state) for label, params, filename in missing]
+    n_jobs = min(n_jobs or cpu_count(), len(tasks))
+    if n_jobs > 1:
+        pool = Pool(n_jobs, initializer=_init_worker, initargs=(X, y))
+        try:
+            results = pool.map(_run, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [oob_curve(X, y, *task) for task in tasks]
+
+    for (label, params, filename), curve in zip(missing, results):
+        curves[label] = curve
+        with open(filename, 'w') as fout:
+            json.dump(curve, fout)
+
+    return curves
@@ -20,73 +20,58 @@ error stabilizes.
 
 """
 import matplotlib.pyplot as plt
-from collections import OrderedDict
-from sklearn.ensemble import RandomForestClassifier
 import pandas as pd
 
+from oob_curves import oob_curves
+
 # Author: Kian Ho <hui.kian.ho@gmail.com>
 #         Gilles Louppe <g.louppe@gmail.com>
 #         Andreas Mueller <amueller@ais.uni-bonn.de>
 #
 # License: BSD 3 Clause
 
-print(__doc__)
-
 RANDOM_STATE = 123
 
-# Import the binary classification dataset
-data = pd.read_csv('ebay_data_rf.csv', index_col=False)
-data.drop('value', axis=1, inplace=True)
-
-y = data.sellingState
-X = data.drop('sellingState', axis=1)
-
-# NOTE: Setting the `warm_start` construction parameter to `True` disables
-# support for paralellised ensembles but is necessary for tracking the OOB
-# error trajectory during training.
-ensemble_clfs = [
-    ("RandomForestClassifier, max_features=5",
-        RandomForestClassifier(warm_start=True,
-                               max_features="sqrt",
-                               oob_score=True,
-                               random_state=RANDOM_STATE)),
-    ("RandomForestClassifier, max_features=7",
-        RandomForestClassifier(warm_start=True,
-                               max_features=7,
-                               oob_score=True,
-                               random_state=RANDOM_STATE)),
-    ("RandomForestClassifier, max_features=21",
-        RandomForestClassifier(warm_start=True,
-                               max_features=None,
-                               oob_score=True,
-                               random_state=RANDOM_STATE))
-]
-
-# Map a classifier name to a list of (<n_estimators>, <error rate>) pairs.
-error_rate = OrderedDict((label, []) for label, _ in ensemble_clfs)
-
-# Range of `n_estimators` values to explore.
-min_estimators = 40
-max_estimators = 180
-
-for label, clf in ensemble_clfs:
-    for i in range(min_estimators, max_estimators + 1):
-        clf.set_params(n_estimators=i)
-        clf.fit(X, y)
-
-        # Record the OOB error for each `n_estimators=i` setting.
-        oob_error = 1 - clf.oob_score_
-        error_rate[label].append((i, oob_error))
-
-# Generate the "OOB error rate" vs. "n_estimators" plot.
-for label, clf_err in error_rate.items():
-    xs, ys = zip(*clf_err)
-    plt.plot(xs, ys, label=label)
-
-plt.title("Dependence of OOB error on number of trees (n_estimators)")
-plt.xlim(min_estimators, max_estimators)
-plt.xlabel("n_estimators")
-plt.ylabel("OOB error rate")
-plt.legend(loc="upper right")
-
-plt.savefig("../../static/OOB_n_features.png")
+
+# The body runs under the main guard because oob_curves starts a
+# process pool, whose workers import this module when processes
+# are spawned (macOS, Windows)
+if __name__ == '__main__':
+    print(__doc__)
+
+    # Import the binary classification dataset
+    data = pd.read_csv('ebay_data_rf.csv', index_col=False)
+    data.drop('value', axis=1, inplace=True)
+
+    y = data.sellingState
+    X = data.drop('sellingState', axis=1)
+
+    # The forests are grown with `warm_start` (see oob_curves.py), one
+    # configuration per process, and the curves are cached on disk.
+    ensemble_clfs = [
+        ("RandomForestClassifier, max_features=5", {'max_features': "sqrt"}),
+        ("RandomForestClassifier, max_features=7", {'max_features': 7}),
+        ("RandomForestClassifier, max_features=21", {'max_features': None})
+    ]
+
+    # Range of `n_estimators` values to explore.
+    min_estimators = 40
+    max_estimators = 180
+
+    # Map a classifier name to a list of (<n_estimators>, <error rate>) pairs.
+    error_rate = oob_curves(X, y, ensemble_clfs,
+                            range(min_estimators, max_estimators + 1),
+                            random_state=RANDOM_STATE)
+
+    # Generate the "OOB error rate" vs. "n_estimators" plot.
+    for label, clf_err in error_rate.items():
+        xs, ys = zip(*clf_err)
+        plt.plot(xs, ys, label=label)
+
+    plt.title("Dependence of OOB error on number of trees (n_estimators)")
+    plt.xlim(min_estimators, max_estimators)
+    plt.xlabel("n_estimators")
+    plt.ylabel("OOB error rate")
+    plt.legend(loc="upper right")
+
+    plt.savefig("../../static/OOB_n_features.png")
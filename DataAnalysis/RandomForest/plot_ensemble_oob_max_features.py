@@ -22,62 +22,55 @@ error stabilizes.
 import matplotlib.pyplot as plt
 
 from collections import OrderedDict
-from sklearn.datasets import make_classification
-from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 import pandas as pd
 
+from oob_curves import oob_curves
+
 # Author: Kian Ho <hui.kian.ho@gmail.com>
 #         Gilles Louppe <g.louppe@gmail.com>
 #         Andreas Mueller <amueller@ais.uni-bonn.de>
 #
 # License: BSD 3 Clause
 
-print(__doc__)
-
 RANDOM_STATE = 123
 
-# Import the binary classification dataset
-data = pd.read_csv('ebay_data_rf.csv', index_col=False)
-data.drop('value', axis=1, inplace=True)
-
-y = data.sellingState
-X = data.drop('sellingState', axis=1)
-
-# NOTE: Setting the `warm_start` construction parameter to `True` disables
-# support for paralellised ensembles but is necessary for tracking the OOB
-# error trajectory during training.
-ensemble_clfs = [
-    ("RandomForestClassifier, max_features='sqrt'",
-        RandomForestClassifier(n_estimators = 140,
-                               oob_score=True,
-                               random_state=RANDOM_STATE)),
-]
-
-# Map a classifier name to a list of (<n_estimators>, <error rate>) pairs.
-error_rate = OrderedDict((label, []) for label, _ in ensemble_clfs)
-
-# Range of `n_estimators` values to explore.
-min_par = 3
-max_par = 21
-
-for label, clf in ensemble_clfs:
-    for i in range(min_par, max_par + 1):
-        clf.set_params(max_features=i)
-        clf.fit(X, y)
-
-        # Record the OOB error for each `max_estimators=i` setting.
-        oob_error = 1 - clf.oob_score_
-        error_rate[label].append((i, oob_error))
-
-# Generate the "OOB error rate" vs. "n_estimators" plot.
-for label, clf_err in error_rate.items():
-    xs, ys = zip(*clf_err)
-    plt.plot(xs, ys, label=label)
-
-plt.title("Depence of OOB error on 'max_features'")
-plt.xlim(min_par, max_par)
-plt.xlabel("max_features")
-plt.ylabel("OOB error rate")
-# plt.legend(loc="upper right")
-
-plt.savefig("../../static/OOB_max_features.png")
+
+# The body runs under the main guard because oob_curves starts a
+# process pool, whose workers import this module when processes
+# are spawned (macOS, Windows)
+if __name__ == '__main__':
+    print(__doc__)
+
+    # Import the binary classification dataset
+    data = pd.read_csv('ebay_data_rf.csv', index_col=False)
+    data.drop('value', axis=1, inplace=True)
+
+    y = data.sellingState
+    X = data.drop('sellingState', axis=1)
+
+    # Range of `max_features` values to explore, each with 140 trees.
+    min_par = 3
+    max_par = 21
+    n_estimators = 140
+
+    # One forest per `max_features` setting, run concurrently (see
+    # oob_curves.py); the curves are cached on disk.
+    configs = [(i, {'max_features': i}) for i in range(min_par, max_par + 1)]
+    curves = oob_curves(X, y, configs, [n_estimators], random_state=RANDOM_STATE)
+
+    # Map a classifier name to a list of (<max_features>, <error rate>) pairs.
+    error_rate = OrderedDict([("RandomForestClassifier, max_features='sqrt'",
+                               [(i, curve[-1][1]) for i, curve in curves.items()])])
+
+    # Generate the "OOB error rate" vs. "n_estimators" plot.
+    for label, clf_err in error_rate.items():
+        xs, ys = zip(*clf_err)
+        plt.plot(xs, ys, label=label)
+
+    plt.title("Depence of OOB error on 'max_features'")
+    plt.xlim(min_par, max_par)
+    plt.xlabel("max_features")
+    plt.ylabel("OOB error rate")
+    # plt.legend(loc="upper right")
+
+    plt.savefig("../../static/OOB_max_features.png")
@@ -5,13 +5,15 @@ from bokeh.models import Range1d
 from bokeh.io import hplot
 from bokeh.plotting import figure
 from datetime import datetime
+from listing_store import ListingStore
 
 #######################################################
 # Data import and cleanup
 #######################################################
 
-# Read in the pandas.DataFrame from csv
-data = pd.read_csv('Data/ebay_data.csv', index_col=False)
+# Read the columns used below from the listing store
+data = ListingStore().read(['shippingType', 'listingType', 'sellingState', 'value',
+                            'conditionDisplayName', 'productId_value'])
 
 
 
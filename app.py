@@ -1,10 +1,22 @@
-from flask import Flask, render_template, url_for, redirect
+from flask import Flask, Response, abort, render_template, request, url_for, redirect
+from pandas.tseries.frequencies import to_offset
+
+from live_pipeline import LATENCY_PATH
+from metrics_store import MetricsStore
 
 app = Flask(__name__)
 
 # App variables
 app.vars = {}
 
+# The running metrics written by clock.py, re-read incrementally
+def get_metrics():
+    if 'metrics' not in app.vars:
+        app.vars['metrics'] = MetricsStore()
+    metrics = app.vars['metrics']
+    metrics.refresh()
+    return metrics
+
 # Routing
 @app.route('/')
 def main():
@@ -34,6 +46,37 @@ def prod_hist():
 def rf():
     return render_template('runningscore.html')
 
+# The last n ticks (default 500) of the running metrics as JSON
+# records, or with bucket=<pandas frequency> (e.g. 10min) their
+# averages over buckets of that width. Answers 400 if n is not a
+# whole number between 1 and the size of the metrics tail, or if
+# bucket is not a positive frequency.
+@app.route('/livefeed/data', methods = ['GET'])
+def livefeed_data():
+    metrics = get_metrics()
+
+    try:
+        n = int(request.args.get('n', 500))
+    except ValueError:
+        abort(400, "n must be a whole number")
+    if not 1 <= n <= metrics.tail.maxlen:
+        abort(400, "n must be between 1 and %d" % metrics.tail.maxlen)
+
+    bucket = request.args.get('bucket')
+    if bucket:
+        try:
+            offset = to_offset(bucket)
+        except ValueError:
+            abort(400, "bucket must be a pandas frequency such as 10min")
+        if offset.n <= 0:
+            abort(400, "bucket must be a positive frequency")
+        data = metrics.downsample(bucket, n)
+    else:
+        data = metrics.frame(n)
+
+    return Response(data.to_json(orient='records', date_format='iso'),
+                    mimetype='application/json')
+
 # @app.route('/livefeed', methods = ['GET'])
 # def rf():
 #     return redirect(url_for('static', filename='runningscore.html'))
@@ -43,6 +86,16 @@ def rf():
 #   # send_static_file will guess the correct MIME type
 #   return app.send_static_file(path)
 
+# The per-stage latency histograms of the live pipeline
+@app.route('/livefeed/latency', methods = ['GET'])
+def livefeed_latency():
+    try:
+        with open(LATENCY_PATH) as fin:
+            summary = fin.read()
+    except IOError:
+        summary = '{}'
+    return Response(summary, mimetype='application/json')
+
 # Main function
 if __name__ == '__main__':
     app.run(port=33507, debug=True)
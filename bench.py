@@ -0,0 +1,452 @@
+#######################################################
+# Benchmarks
+#
+# Each benchmark runs offline, against finding_stub.py
+# or synthetic data, e.g.
+#
+#   python bench.py fetch
+#######################################################
+
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import ebay
+import finding_stub
+
+
+def _timeit(fn, *args, **kwargs):
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - start
+
+
+def _stub_options(domain, *argv):
+    opts, args = ebay.init_options(['--domain', domain, '--no-https',
+                                    '--appid', 'stub', '--daily-limit', '0',
+                                    '--quiet'] + list(argv))
+    return opts
+
+
+#######################################################
+# Harvest: serial vs concurrent page fetching
+#######################################################
+
+def bench_fetch(n_pages=100, latency=0.1, workers=(1, 4, 8, 16)):
+    server = finding_stub.serve(n_items=100 * n_pages, latency=latency)
+
+    print("Fetching", n_pages, "pages with", latency, "s latency per request")
+    for n_workers in workers:
+        ebay._fetchers.clear()
+        opts = _stub_options(server.domain, '--workers', str(n_workers))
+        data, seconds = _timeit(ebay.get_all_100, opts, ebay.get_api_dict())
+        print("  workers = %2d: %6.2f s, %d rows" % (n_workers, seconds, len(data)))
+        print("   ", end=" ")
+        ebay.get_fetcher(opts).print_summary()
+
+    server.shutdown()
+
+
+#######################################################
+# Full history: chained 100-page calls vs sharded windows
+#######################################################
+
+def bench_shard(n_items=30000, latency=0.3, n_workers=16):
+    server = finding_stub.serve(n_items=n_items, latency=latency)
+    newest = finding_stub.NEWEST.strftime(finding_stub.TIME_FORMAT)
+    oldest = '2016-01-01T00:00:00.000Z'
+
+    print("Harvesting", n_items, "listings with", n_workers, "workers")
+    for name in ['get_all', 'get_all_sharded']:
+        ebay._fetchers.clear()
+        opts = _stub_options(server.domain, '--workers', str(n_workers))
+        api_request = ebay.get_api_dict()
+        if name == 'get_all':
+            ebay._set_item_filter(api_request, 'EndTimeFrom', oldest)
+            data, seconds = _timeit(ebay.get_all, opts, api_request)
+        else:
+            data, seconds = _timeit(ebay.get_all_sharded, opts, api_request,
+                                    oldest, newest)
+        print("  %-16s %6.2f s, %d unique listings, %d requests"
+              % (name, seconds, data.itemId.nunique(), ebay.get_request_count(opts)))
+
+    server.shutdown()
+
+
+#######################################################
+# Extraction: per-item dicts vs columnar
+#######################################################
+
+def _get_key_value(dict, key):
+    if key in dict:
+        return (dict[key])
+    else:
+        return ('NA')
+
+
+# The per-item dict extraction that ebay._get_relevant_data replaced
+def _get_relevant_data_dicts(listings):
+    dicts = []
+    for item in listings:
+        entry = {'conditionDisplayName': item['condition']['conditionDisplayName'],
+                 'conditionId': item['condition']['conditionId'],
+                 'country': item['country'],
+                 'itemId': item['itemId'],
+                 'bestOfferEnabled': item['listingInfo']['bestOfferEnabled'] == 'true',
+                 'buyItNowAvailable': item['listingInfo']['buyItNowAvailable'] == 'true',
+                 'gift': item['listingInfo']['gift'] == 'true',
+                 'listingType': item['listingInfo']['listingType'],
+                 'startTime': item['listingInfo']['startTime'],
+                 'endTime': item['listingInfo']['endTime'],
+                 'paymentMethod': item['paymentMethod'],
+                 'postalCode': _get_key_value(item, 'postalCode'),
+                 'categoryId': item['primaryCategory']['categoryId'],
+                 'categoryName': item['primaryCategory']['categoryName'],
+                 'productId_type': _get_key_value(_get_key_value(item, 'productId'), '_type'),
+                 'productId_value': _get_key_value(_get_key_value(item, 'productId'), 'value'),
+                 'returnsAccepted': item['returnsAccepted'] == 'true',
+                 'value': float(item['sellingStatus']['currentPrice']['value']),
+                 'bidCount': _get_key_value(_get_key_value(item, 'sellingStatus'), 'bidCount'),
+                 'sellingState': item['sellingStatus']['sellingState'],
+                 'expeditedShipping': item['shippingInfo']['expeditedShipping'] == 'true',
+                 'shippingType': item['shippingInfo']['shippingType'],
+                 'title': item['title'],
+                 'topRatedListing': item['topRatedListing'] == 'true',
+                 'feedbackRatingStar': _get_key_value(_get_key_value(item, 'sellerInfo'), 'feedbackRatingStar'),
+                 'feedbackScore': _get_key_value(_get_key_value(item, 'sellerInfo'), 'feedbackScore'),
+                 'positiveFeedbackPercent': _get_key_value(_get_key_value(item, 'sellerInfo'),
+                                                           'positiveFeedbackPercent'),
+                 'topRatedSeller': _get_key_value(_get_key_value(item, 'sellerInfo'), 'topRatedSeller')}
+        dicts.append(entry)
+
+    return (pd.DataFrame(dicts))
+
+
+def bench_extract(n_items=10000, repeat=5):
+    items = [finding_stub.make_item(i) for i in range(n_items)]
+    pages = [items[i:i + 100] for i in range(0, n_items, 100)]
+
+    def per_page():
+        return pd.concat([_get_relevant_data_dicts(page) for page in pages])
+
+    def columnar():
+        return ebay._get_relevant_data(items)
+
+    print("Extracting", n_items, "synthetic items")
+    results = {}
+    for name, fn in [('per-item dicts + concat', per_page), ('columnar', columnar)]:
+        best = min(_timeit(fn)[1] for _ in range(repeat))
+        results[name] = fn()
+        print("  %-24s %7.1f ms" % (name, 1000 * best))
+
+    old, new = results['per-item dicts + concat'], results['columnar']
+    old = old[new.columns].reset_index(drop=True)
+    print("  identical output:", old.equals(new))
+
+
+#######################################################
+# Memory: in-memory harvest vs streaming to disk
+#######################################################
+
+def _harvest(domain, stream, path, result):
+    opts = _stub_options(domain, '--workers', '8')
+    if stream:
+        ebay.harvest_to_disk(opts, ebay.get_api_dict(), [ebay.CsvChunkWriter(path)])
+    else:
+        data = ebay.preproc(ebay.get_all(opts, ebay.get_api_dict()))
+        data.to_csv(path, na_rep="NA", index=False, encoding='utf-8')
+    result.put(ebay.peak_rss_mb())
+
+
+def bench_stream(n_items=60000):
+    import multiprocessing
+    import os
+    import tempfile
+
+    server = finding_stub.serve(n_items=n_items)
+    path = os.path.join(tempfile.mkdtemp(), 'listings.csv')
+
+    print("Harvesting", n_items, "listings to", path)
+    for name, stream in [('get_all + preproc + to_csv', False),
+                         ('harvest_to_disk', True)]:
+        result = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_harvest,
+                                       args=(server.domain, stream, path, result))
+        proc.start()
+        peak = result.get()
+        proc.join()
+        print("  %-28s peak RSS %7.1f MB" % (name, peak))
+
+    server.shutdown()
+
+
+#######################################################
+# Throttling: unpaced vs paced requests
+#######################################################
+
+def bench_throttle(n_pages=100, max_rate=8.0, n_workers=8):
+    server = finding_stub.serve(n_items=100 * n_pages, latency=0.05, max_rate=max_rate)
+
+    print("Fetching", n_pages, "pages from a stub that allows", max_rate, "calls/s")
+    for rate in [None, max_rate]:
+        ebay._fetchers.clear()
+        server.n_requests = server.n_throttled = 0
+        argv = ['--workers', str(n_workers), '--retries', '8']
+        if rate:
+            argv += ['--rate', str(rate)]
+        opts = _stub_options(server.domain, *argv)
+        data, seconds = _timeit(ebay.get_all_100, opts, ebay.get_api_dict())
+        print("  rate = %-5s %6.2f s, %d rows, %d calls, %d throttled"
+              % (rate, seconds, len(data), server.n_requests, server.n_throttled))
+
+    server.shutdown()
+
+
+#######################################################
+# Time features: dateutil per row vs bulk parsing
+#######################################################
+
+# The per-row times_to_categorical that preproc_rf replaced
+def _times_to_categorical_dateutil(data):
+    from dateutil.parser import parse
+
+    data['startHour'] = [parse(x).hour for x in data.startTime]
+    data['startWeekday'] = [parse(x).weekday() for x in data.startTime]
+    data['startMonthday'] = [parse(x).day for x in data.startTime]
+    data['startMonth'] = [parse(x).month for x in data.startTime]
+
+    data['endHour'] = [parse(x).hour for x in data.endTime]
+    data['endWeekday'] = [parse(x).weekday() for x in data.endTime]
+    data['endMonthday'] = [parse(x).day for x in data.endTime]
+    data['endMonth'] = [parse(x).month for x in data.endTime]
+
+    return(data)
+
+
+def bench_times(path='Data/ebay_data_rf_endTime.csv'):
+    import preproc_rf
+
+    times = pd.read_csv(path, usecols=['endTime'])
+    times['startTime'] = times['endTime']
+
+    print("Time features for", len(times), "rows of", path)
+    old, old_s = _timeit(_times_to_categorical_dateutil, times.copy())
+    new, new_s = _timeit(preproc_rf.times_to_categorical, times.copy())
+    print("  dateutil per row:  %7.3f s" % old_s)
+    print("  bulk to_datetime:  %7.3f s" % new_s)
+
+    same = all((old[f].values == new[f].values).all() for f in preproc_rf.KEPT_TIME_FEATURES)
+    print("  identical kept features:", same)
+
+
+#######################################################
+# Memory: object columns vs the schema dtypes
+#######################################################
+
+def bench_memory(path='Data/ebay_data_rf_endTime.csv', n_items=44800):
+    import schema
+
+    old = pd.read_csv(path, index_col=False)
+    new = schema.read_rf_csv(path)
+    print("Training data,", len(old), "rows of", path)
+    print("  default dtypes:    %7.2f MB" % schema.memory_mb(old))
+    print("  RF_DTYPES:         %7.2f MB" % schema.memory_mb(new))
+    same = all(np.allclose(old[col], new[col], rtol=1e-6) if col in schema.RF_DTYPES
+               else old[col].equals(new[col]) for col in old)
+    print("  same values (float32 to 1e-6):", same)
+
+    items = [finding_stub.make_item(i) for i in range(n_items)]
+    new = ebay.preproc(ebay._get_relevant_data(items))
+
+    # ebay.preproc without the schema
+    old = ebay._get_relevant_data(items)
+    old['isShippingFree'] = ebay._map_column(old['shippingType'], ebay.SHIPPING_IS_FREE, 'shipping type')
+    old['listingType'] = ebay._map_column(old['listingType'], ebay.SIMPLE_LISTING_TYPES, 'listing type')
+    old = old[new.columns]
+    print("Listings,", n_items, "synthetic items")
+    print("  object columns:    %7.2f MB" % schema.memory_mb(old))
+    print("  LISTING_DTYPES:    %7.2f MB" % schema.memory_mb(new))
+
+
+#######################################################
+# Redundant columns: pairwise comparison vs hashing
+#######################################################
+
+# The pairwise remove_duplicate_cols that preproc_rf replaced
+def _duplicate_cols_pairwise(data):
+    colsToRemove = []
+    columns = data.columns
+    for i in range(len(columns)-1):
+        v = data[columns[i]].values
+        for j in range(i+1,len(columns)):
+            if np.array_equal(v,data[columns[j]].values):
+                colsToRemove.append(columns[j])
+    return colsToRemove
+
+
+def bench_redundant(path='Data/ebay_data_rf.csv', n_extra=300, seed=7):
+    import preproc_rf
+    import schema
+
+    data = schema.read_rf_csv(path)
+    rng = np.random.RandomState(seed)
+    extra = {}
+    for i in range(n_extra):
+        if i % 3 == 0:
+            extra['copy%d' % i] = data[data.columns[i % len(data.columns)]].values
+        elif i % 3 == 1:
+            extra['const%d' % i] = np.zeros(len(data), dtype='int8')
+        else:
+            extra['onehot%d' % i] = (rng.rand(len(data)) < 0.1).astype('int8')
+    data = pd.concat([data, pd.DataFrame(extra)], axis=1)
+
+    print("Redundant columns in", data.shape[0], "rows x", data.shape[1], "columns")
+    old, old_s = _timeit(_duplicate_cols_pairwise, data)
+    (constant, duplicate), new_s = _timeit(preproc_rf.find_redundant_cols, data)
+    print("  pairwise array_equal: %7.3f s, %d duplicates" % (old_s, len(set(old))))
+    print("  hashed buckets:       %7.3f s, %d duplicates + %d constant"
+          % (new_s, len(duplicate), len(constant)))
+
+
+#######################################################
+# Scoring: predict + predict_proba vs one pass
+#######################################################
+
+def _fit_forest(path='Data/ebay_data_rf.csv', n_train=30000, n_estimators=100):
+    from sklearn.ensemble import RandomForestClassifier
+    import schema
+
+    data = schema.read_rf_csv(path)
+    y = data.pop('sellingState')
+    clf = RandomForestClassifier(n_estimators, max_features=None, random_state=7)
+    clf.fit(data[:n_train], y[:n_train])
+    return clf, data[n_train:], y[n_train:]
+
+
+def bench_score(batch_size=100, repeat=20):
+    from sklearn.metrics import confusion_matrix, roc_auc_score
+    import scoring
+
+    clf, X, y = _fit_forest()
+    X, y = X[:batch_size], y[:batch_size]
+
+    def two_passes():
+        y_pred = clf.predict(X)
+        return confusion_matrix(y, y_pred), roc_auc_score(y, clf.predict_proba(X)[:, 1])
+
+    def one_pass():
+        return scoring.score(clf, X, y)
+
+    print("Scoring batches of", batch_size, "with", len(clf.estimators_), "trees")
+    for name, fn in [('predict + predict_proba', two_passes), ('scoring.score', one_pass)]:
+        best = min(_timeit(fn)[1] for _ in range(repeat))
+        print("  %-24s %7.1f ms" % (name, 1000 * best))
+    print("  stages:", one_pass()['timer'])
+
+
+#######################################################
+# Inference: sklearn forest vs flat arrays
+#######################################################
+
+def bench_flat(batch_sizes=(1, 10, 100, 1000, 10000), repeat=5):
+    import os
+    import pickle
+    import tempfile
+    from flat_forest import FlatForest
+
+    clf, X, y = _fit_forest()
+    X = X.values.astype('float32')
+    flat = FlatForest.from_sklearn(clf)
+
+    tmp = tempfile.mkdtemp()
+    pkl, flat_dir = os.path.join(tmp, 'rf.pkl'), os.path.join(tmp, 'rf.flat')
+    with open(pkl, 'wb') as fout:
+        pickle.dump(clf, fout, protocol=2)
+    flat.save(flat_dir)
+    flat_mb = sum(os.path.getsize(os.path.join(flat_dir, name))
+                  for name in os.listdir(flat_dir)) / 2.0 ** 20
+
+    print("Loading", len(clf.estimators_), "trees")
+    print("  pickle: %7.1f ms, %6.1f MB"
+          % (1000 * min(_timeit(lambda: pickle.load(open(pkl, 'rb')))[1] for _ in range(repeat)),
+             os.path.getsize(pkl) / 2.0 ** 20))
+    print("  flat:   %7.1f ms, %6.1f MB"
+          % (1000 * min(_timeit(FlatForest.load, flat_dir)[1] for _ in range(repeat)),
+             flat_mb))
+    print("  mapped: %7.1f ms"
+          % (1000 * min(_timeit(FlatForest.load, flat_dir, 'r')[1] for _ in range(repeat))))
+
+    print("Scoring")
+    for batch_size in batch_sizes:
+        batch = X[:batch_size]
+        old = min(_timeit(clf.predict_proba, batch)[1] for _ in range(repeat))
+        new = min(_timeit(flat.predict_proba, batch)[1] for _ in range(repeat))
+        same = (clf.predict_proba(batch) == flat.predict_proba(batch)).all()
+        print("  batch %5d: predict_proba %8.1f ms, flat %8.1f ms, identical: %s"
+              % (len(batch), 1000 * old, 1000 * new, same))
+
+
+#######################################################
+# Metrics: re-reading running_data.csv vs the store
+#######################################################
+
+def _metrics_row(i):
+    from datetime import datetime, timedelta
+    return {'Accuracy': 0.66, 'False neg.': 0.07, 'False pos.': 0.27, 'ROC-AUC': 0.73,
+            'Time': datetime(2016, 5, 4) + timedelta(seconds=20 * i, microseconds=1),
+            'True neg.': 0.16, 'True pos.': 0.5}
+
+
+# One tick of the old clock.update_data + make_plots data path
+def _metrics_tick_csv(path, row):
+    from datetime import datetime
+    pd.DataFrame([row]).to_csv(path, header=False, mode='a', index=False)
+    data = pd.read_csv(path, index_col=False)
+    time = [datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f') for x in data.Time]
+    return data, time
+
+
+def bench_metrics(sizes=(510, 10000, 100000), n_ticks=20):
+    import os
+    import tempfile
+    from metrics_store import MetricsStore, COLUMNS
+
+    print("Per tick cost of appending a row and loading the plotted data")
+    for size in sizes:
+        path = os.path.join(tempfile.mkdtemp(), 'running_data.csv')
+        pd.DataFrame([_metrics_row(i) for i in range(size)], columns=COLUMNS).to_csv(path, index=False)
+
+        old = min(_timeit(_metrics_tick_csv, path, _metrics_row(size + i))[1]
+                  for i in range(n_ticks))
+
+        store, load = _timeit(MetricsStore, path, 1000)
+
+        def tick(i):
+            store.append(_metrics_row(i))
+            return store.frame()
+
+        new = min(_timeit(tick, size + n_ticks + i)[1] for i in range(n_ticks))
+        print("  %6d rows: read_csv + strptime %8.1f ms, MetricsStore %6.1f ms (%.1f ms to open)"
+              % (size, 1000 * old, 1000 * new, 1000 * load))
+
+
+BENCHMARKS = {'metrics': bench_metrics,
+              'flat': bench_flat,
+              'score': bench_score,
+              'redundant': bench_redundant,
+              'memory': bench_memory,
+              'extract': bench_extract,
+              'times': bench_times,
+              'throttle': bench_throttle,
+              'stream': bench_stream,
+              'fetch': bench_fetch,
+              'shard': bench_shard}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
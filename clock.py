@@ -1,12 +1,13 @@
 from preproc_rf import preproc_rf
 import ebay
-import os
-import os.path
+import model_registry
+from metrics_store import MetricsStore
+import scoring
+from live_pipeline import LivePipeline, LATENCY_PATH
+from live_eval import SeenItems, WindowEvaluator
+from retrain_rf import Retrainer
 from apscheduler.schedulers.blocking import BlockingScheduler
-from sklearn.externals import joblib
-from sklearn.metrics import confusion_matrix, roc_auc_score
 import numpy as np
-import pandas as pd
 import datetime
 from bokeh.plotting import figure, output_file, save, vplot
 from bokeh.models import Range1d
@@ -15,7 +16,29 @@ logging.basicConfig()
 
 sched = BlockingScheduler()
 
-def api_request():
+# The encoder fitted with the model, reloaded when retraining
+# extends it
+def get_encoder():
+    return model_registry.get_encoder()
+
+# The listings scored so far, and the metrics over the last hour
+seen_items = SeenItems()
+evaluator = WindowEvaluator()
+
+# The running metrics, with the recent ticks kept parsed (enough
+# of them for the drift checks)
+_metrics = []
+
+def get_metrics():
+    if not _metrics:
+        _metrics.append(MetricsStore(tail_size=5000))
+    return _metrics[0]
+
+retrainer = Retrainer()
+
+# Returns the preprocessed listings of the newest page and their
+# itemIds, or None if there are none
+def api_request(get_page=ebay._get_page, seen=None):
     # Specify the API request
 
     api_dict = ebay.get_api_dict()
@@ -25,23 +48,39 @@ def api_request():
 
     (opts, args) = ebay.init_options()
 
-    listings = ebay._get_relevant_data(ebay._get_page(opts, api_request=api_dict)['searchResult']['item'])
+    page = get_page(opts, api_request=api_dict)
+    if page is None or 'item' not in page.get('searchResult', {}):
+        return None
+
+    listings = ebay._get_relevant_data(page['searchResult']['item'])
 
     listings = ebay.preproc(listings)
 
-    listings = preproc_rf(listings)
+    # Only score the listings that were not scored on an earlier
+    # page (they are marked as seen once they have been scored)
+    if seen is not None:
+        listings = listings[seen.new_mask(listings.itemId)]
+        if not len(listings):
+            return None
+
+    item_ids = listings.itemId.values
 
-    return(listings)
+    listings = preproc_rf(listings, get_encoder())
 
-def predict_and_compare(X, y):
-    clf = joblib.load('static/model_pkl/rf_model_april_27_2016.pkl')
+    return listings, item_ids
 
-    y_pred = clf.predict(X)
+# With an evaluator, the batch is added to its window and the
+# metrics returned are the window's rather than the batch's
+def predict_and_compare(X, y, timer=None, evaluator=None, timestamp=None):
+    clf = model_registry.get_model(n_rows=len(X))
 
-    cmat = confusion_matrix(y, y_pred)
-    auc = roc_auc_score(y, clf.predict_proba(X)[:, 1], average="weighted")
+    result = scoring.score(clf, X, y, timer)
+    if evaluator is None:
+        return [result['cmat'], result['auc']]
 
-    return [cmat, auc]
+    evaluator.add(timestamp, y, result['labels'], result['proba'][:, 1])
+
+    return [evaluator.cmat, evaluator.auc()]
 
 def update_data(datetime, cmat, auc):
     # calculate the quantities to write to the dataframe
@@ -55,23 +94,16 @@ def update_data(datetime, cmat, auc):
 
     data = [{"Time": datetime, "True pos.": tpos, "False pos.":fpos,"True neg.": tneg, "False neg.":fneg, "ROC-AUC": auc , "Accuracy": acc}]
 
-    # create a pandas dataframe with one row
-    df = pd.DataFrame(data)
-
-    # update the files
-    if os.path.isfile("static/running_data.csv"):
-        df.to_csv("static/running_data.csv", header=False, mode='a', index=False)
-    else:
-        df.to_csv("static/running_data.csv", header=True, index= False)
+    # append the row to the metrics file
+    get_metrics().append(data[0])
 
-def to_dt(dt_str):
-    format = '%Y-%m-%d %H:%M:%S.%f'
-    return datetime.datetime.strptime(dt_str, format)
+# The number of most recent ticks that are plotted
+PLOT_POINTS = 1000
 
 def make_plots():
-    data = pd.read_csv("static/running_data.csv", index_col=False)
+    data = get_metrics().frame(PLOT_POINTS)
 
-    time = [to_dt(x) for x in data.Time]
+    time = data.Time
 
     dt = max(time)
     last_time = datetime.datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute)
@@ -122,25 +154,75 @@ def make_plots():
 # DataAnalysis.RandomForest.preproc_rf
 ##################################################
 
-@sched.scheduled_job('interval', seconds=20)
-def timed_job():
+# The stages of the live pipeline (see live_pipeline.py)
+
+def fetch_stage(timestamp, get_page=ebay._get_page):
     # Get the new data
-    timestamp = datetime.datetime.now()
-    new_data = api_request()
+    timer = scoring.StageTimer()
+    with timer.stage('request'):
+        fetched = api_request(get_page, seen_items)
+
+    # Skip this tick if the page could not be fetched or
+    # has no listings that were not scored already
+    if fetched is None:
+        return None
+
+    new_data, item_ids = fetched
+    return new_data, item_ids, timer
+
+def score_stage(timestamp, data):
+    new_data, item_ids, timer = data
+
+    # A listing can be on the pages of two ticks at once; only
+    # the first tick to get here scores it
+    new = seen_items.new_mask(item_ids)
+    if not new.any():
+        return None
+    new_data, item_ids = new_data[new], item_ids[new]
 
     # Separate the target and inputs
     y = new_data.sellingState
     new_data.drop(['sellingState','endTime'], axis=1, inplace=True)
 
     # Predict the selling outcome of new listings
-    cmat, auc = predict_and_compare(new_data, y)
+    cmat, auc = predict_and_compare(new_data, y, timer, evaluator, timestamp)
+
+    # The listings only count as seen once they are in the window,
+    # so a tick that fails before this gets scored again
+    seen_items.add(item_ids)
+
+    return cmat, auc, timer
+
+def publish_stage(timestamp, result):
+    cmat, auc, timer = result
 
     # Update the data files
-    update_data(timestamp, cmat, auc)
+    with timer.stage('update'):
+        update_data(timestamp, cmat, auc)
+
+    # Retrain in the background if the metrics have drifted
+    with timer.stage('drift'):
+        retrainer.check(get_metrics().frame())
 
     # Make new plots
-    make_plots()
+    with timer.stage('plots'):
+        make_plots()
 
     print("Updated at", datetime.datetime.now())
+    print("  %.3f s: %s" % (timer.total(), timer))
+
+# get_page can be replaced, e.g. by a stub for testing
+def make_pipeline(get_page=ebay._get_page, latency_path=LATENCY_PATH):
+    return LivePipeline(lambda timestamp: fetch_stage(timestamp, get_page),
+                        score_stage, publish_stage, latency_path=latency_path)
+
+pipeline = make_pipeline()
+
+@sched.scheduled_job('interval', seconds=20)
+def timed_job():
+    # Queue a tick; the pipeline's threads do the work
+    pipeline.tick()
 
-sched.start()
\ No newline at end of file
+if __name__ == '__main__':
+    pipeline.start()
+    sched.start()
@@ -6,21 +6,28 @@ Licensed under CDDL 1.0
 '''
 
 from optparse import OptionParser
+import resource
+import sys
 from datetime import datetime as dt
+import numpy as np
 import pandas as pd
 import ebaysdk
-from ebaysdk.finding import Connection as finding
-from ebaysdk.exception import ConnectionError
 
+from datetime import timedelta
 from math import ceil
 
+import fetcher
+from response_cache import ResponseCache
+from listing_store import ListingStore
+from schema import apply_schema, LISTING_DTYPES
+
 from pprint import pprint as pp
 
 
 #######################################################
 # Setup
 #######################################################
-def init_options():
+def init_options(argv=None):
     usage = "usage: %prog [options]"
     parser = OptionParser(usage=usage)
 
@@ -33,8 +40,65 @@ def init_options():
     parser.add_option("-a", "--appid",
                       dest="appid", default=None,
                       help="Specifies the eBay application id to use.")
+    parser.add_option("--domain",
+                      dest="domain", default='svcs.ebay.com',
+                      help="Specifies the Finding API host. [default: %default]")
+    parser.add_option("--no-https",
+                      action="store_false", dest="https", default=True,
+                      help="Use plain http, e.g. for a local stub server.")
+    parser.add_option("-w", "--workers",
+                      type="int", dest="workers", default=1,
+                      help="Number of pages fetched concurrently. [default: %default]")
+    parser.add_option("-r", "--rate",
+                      type="float", dest="rate", default=None,
+                      help="Maximum number of requests per second. [default: no cap]")
+    parser.add_option("--retries",
+                      type="int", dest="retries", default=3,
+                      help="Number of retries for a failed page. [default: %default]")
+    parser.add_option("--daily-limit",
+                      type="int", dest="daily_limit", default=fetcher.DAILY_CALL_LIMIT,
+                      help="Daily Finding API call quota, 0 for none. [default: %default]")
+    parser.add_option("-i", "--incremental",
+                      action="store_true", dest="incremental", default=False,
+                      help="Only fetch listings that ended after the last harvest.")
+    parser.add_option("-s", "--sharded",
+                      action="store_true", dest="sharded", default=False,
+                      help="Harvest independent end time windows in parallel.")
+    parser.add_option("--shards",
+                      type="int", dest="shards", default=8,
+                      help="Initial number of end time windows. [default: %default]")
+    parser.add_option("--stream",
+                      action="store_true", dest="stream", default=False,
+                      help="Write each 100-page call to disk as it arrives.")
+    parser.add_option("--csv",
+                      dest="csv", default=None,
+                      help="Also export the stored listings to this CSV file "
+                           "(histograms.R reads Data/ebay_data.csv).")
+    parser.add_option("--end-time",
+                      dest="end_time", default=None,
+                      help="Harvest listings that ended before this GMT time. [default: now]")
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=None,
+                      help="Cache raw responses in this directory.")
+    parser.add_option("--cache-ttl",
+                      type="float", dest="cache_ttl", default=None,
+                      help="Hours before a cached response expires. [default: never]")
+    parser.add_option("--cache-size",
+                      type="float", dest="cache_size", default=None,
+                      help="Maximum size of the response cache in MB. [default: no limit]")
+    parser.add_option("--offline",
+                      action="store_true", dest="offline", default=False,
+                      help="Only use cached responses (requires --cache-dir).")
+    parser.add_option("-q", "--quiet",
+                      action="store_true", dest="quiet", default=False,
+                      help="Do not print progress.")
+
+    (opts, args) = parser.parse_args(argv)
+
+    # Missing pages will not appear by retrying
+    if opts.offline:
+        opts.retries = 0
 
-    (opts, args) = parser.parse_args()
     return opts, args
 
 
@@ -68,119 +132,212 @@ def get_api_dict():
 # Making the api request and table filtering
 #######################################################
 
+# One fetcher (and so one connection pool) is shared by every
+# call made with the same connection options, including the
+# live scorer in clock.py, which rebuilds opts on every tick.
+_fetchers = {}
+
+
+def get_fetcher(opts):
+    key = (opts.debug, opts.appid, opts.yaml, opts.domain, opts.https,
+           opts.cache_dir, opts.offline, opts.rate, opts.daily_limit)
+    if key not in _fetchers:
+        cache = None
+        if opts.cache_dir:
+            cache = ResponseCache(opts.cache_dir,
+                                  ttl=opts.cache_ttl * 3600 if opts.cache_ttl else None,
+                                  max_bytes=opts.cache_size * 1024 ** 2 if opts.cache_size else None)
+        _fetchers[key] = fetcher.FindingFetcher(opts, max_connections=opts.workers,
+                                                cache=cache, offline=opts.offline,
+                                                bucket=fetcher.TokenBucket(opts.rate),
+                                                budget=fetcher.CallBudget(opts.daily_limit or None))
+    _fetchers[key].max_connections = max(_fetchers[key].max_connections, opts.workers)
+    return _fetchers[key]
+
+
 # This is the primitive api call
 # Given the input api_request, returns the input page
 # of listings. This returns the full JSON table dict.
 # Use the API helper functions for normal interface
 def _get_page(opts, api_request, page_number=1):
-    api_request['paginationInput'] = {"entriesPerPage": 100,
-                                      "pageNumber": page_number}
-
-    try:
-        api = finding(debug=opts.debug, appid=opts.appid,
-                      config_file=opts.yaml, warnings=True)
-
-        # Strip the list of results
-        response = api.execute('findCompletedItems', api_request).dict()
-
-        return (response)
-
-        # dump(api)
-    except ConnectionError as e:
-        print(e)
-        print(e.response.dict())
+    return get_fetcher(opts).get_page(api_request, page_number)
+
+
+# Fetches fetch_page(task) for every task through the scheduler
+# in fetcher.fetch_pages, where fetch_page raises on failure (see
+# FindingFetcher.fetch_page). Failed pages are requeued with
+# backoff; pages that still fail are returned as None.
+def _fetch_pages(opts, fetch_page, tasks, verbose=None):
+    return fetcher.fetch_pages(fetch_page, tasks,
+                               n_workers=opts.workers,
+                               max_retries=opts.retries,
+                               verbose=not opts.quiet if verbose is None else verbose)
+
+
+# The extracted columns, grouped by the sub-dict of the item they
+# come from: (path to the sub-dict, [(column, key), ...]).
+# A missing sub-dict or key gives 'NA'.
+_FIELDS = [((), [('country', 'country'),
+                 ('itemId', 'itemId'),
+                 ('paymentMethod', 'paymentMethod'),
+                 ('postalCode', 'postalCode'),
+                 ('returnsAccepted', 'returnsAccepted'),
+                 ('title', 'title'),
+                 ('topRatedListing', 'topRatedListing')]),
+           (('condition',), [('conditionDisplayName', 'conditionDisplayName'),
+                             ('conditionId', 'conditionId')]),
+           (('listingInfo',), [('bestOfferEnabled', 'bestOfferEnabled'),
+                               ('buyItNowAvailable', 'buyItNowAvailable'),
+                               ('gift', 'gift'),
+                               ('listingType', 'listingType'),
+                               ('startTime', 'startTime'),
+                               ('endTime', 'endTime')]),
+           (('primaryCategory',), [('categoryId', 'categoryId'),
+                                   ('categoryName', 'categoryName')]),
+           (('productId',), [('productId_type', '_type'),
+                             ('productId_value', 'value')]),
+           (('sellingStatus',), [('bidCount', 'bidCount'),
+                                 ('sellingState', 'sellingState')]),
+           (('sellingStatus', 'currentPrice'), [('value', 'value')]),
+           (('shippingInfo',), [('expeditedShipping', 'expeditedShipping'),
+                                ('shippingType', 'shippingType')]),
+           (('sellerInfo',), [('feedbackRatingStar', 'feedbackRatingStar'),
+                              ('feedbackScore', 'feedbackScore'),
+                              ('positiveFeedbackPercent', 'positiveFeedbackPercent'),
+                              ('topRatedSeller', 'topRatedSeller')])]
+
+# 'true'/'false' fields that become bools
+_BOOL_COLUMNS = ['bestOfferEnabled', 'buyItNowAvailable', 'gift',
+                 'returnsAccepted', 'expeditedShipping', 'topRatedListing']
+
+_NO_FIELDS = {}
+
+_COLUMN_ORDER = ['conditionDisplayName', 'conditionId', 'country', 'itemId',
+                 'bestOfferEnabled', 'buyItNowAvailable', 'gift', 'listingType',
+                 'startTime', 'endTime', 'paymentMethod', 'postalCode',
+                 'categoryId', 'categoryName', 'productId_type', 'productId_value',
+                 'returnsAccepted', 'value', 'bidCount', 'sellingState',
+                 'expeditedShipping', 'shippingType', 'title', 'topRatedListing',
+                 'feedbackRatingStar', 'feedbackScore', 'positiveFeedbackPercent',
+                 'topRatedSeller']
 
 
 # Should return a pandas df
+# Walks the items once, appending each field to its column list,
+# then converts the bool and float columns in bulk. Pass all the
+# items of a harvest at once to get a single data frame.
 def _get_relevant_data(listings):
-    dicts = []
+    data = {}
+    groups = [(path, [(key, data.setdefault(column, [])) for column, key in fields])
+              for path, fields in _FIELDS]
+
     for item in listings:
-        entry = {'conditionDisplayName': item['condition']['conditionDisplayName'],
-                 'conditionId': item['condition']['conditionId'],
-                 'country': item['country'],
-                 'itemId': item['itemId'],
-                 'bestOfferEnabled': item['listingInfo']['bestOfferEnabled'] == 'true',
-                 'buyItNowAvailable': item['listingInfo']['buyItNowAvailable'] == 'true',
-                 'gift': item['listingInfo']['gift'] == 'true',
-                 'listingType': item['listingInfo']['listingType'],
-                 'startTime': item['listingInfo']['startTime'],
-                 'endTime': item['listingInfo']['endTime'],
-                 # item['location'],
-                 'paymentMethod': item['paymentMethod'],
-                 'postalCode': _get_key_value(item, 'postalCode'),
-                 'categoryId': item['primaryCategory']['categoryId'],
-                 'categoryName': item['primaryCategory']['categoryName'],
-                 'productId_type': _get_key_value(_get_key_value(item, 'productId'), '_type'),
-                 'productId_value': _get_key_value(_get_key_value(item, 'productId'), 'value'),
-                 'returnsAccepted': item['returnsAccepted'] == 'true',
-                 'value': float(item['sellingStatus']['currentPrice']['value']),
-                 'bidCount': _get_key_value(_get_key_value(item, 'sellingStatus'), 'bidCount'),
-                 'sellingState': item['sellingStatus']['sellingState'],
-                 'expeditedShipping': item['shippingInfo']['expeditedShipping'] == 'true',
-                 # 'handlingTime': item['shippingInfo']['handlingTime'],
-                 'shippingType': item['shippingInfo']['shippingType'],
-                 'title': item['title'],
-                 'topRatedListing': item['topRatedListing'] == 'true',
-                 'feedbackRatingStar': _get_key_value(_get_key_value(item, 'sellerInfo'), 'feedbackRatingStar'),
-                 'feedbackScore': _get_key_value(_get_key_value(item, 'sellerInfo'), 'feedbackScore'),
-                 'positiveFeedbackPercent': _get_key_value(_get_key_value(item, 'sellerInfo'),
-                                                           'positiveFeedbackPercent'),
-                 'topRatedSeller': _get_key_value(_get_key_value(item, 'sellerInfo'), 'topRatedSeller')}
-        dicts.append(entry)
-
-    return (pd.DataFrame(dicts))
-
-
-def _get_key_value(dict, key):
-    if key in dict:
-        return (dict[key])
-    else:
-        return ('NA')
+        for path, fields in groups:
+            sub = item
+            for key in path:
+                sub = sub.get(key, _NO_FIELDS)
+            for key, values in fields:
+                values.append(sub.get(key, 'NA'))
+
+    for column in _BOOL_COLUMNS:
+        data[column] = np.array(data[column], dtype=object) == 'true'
+    data['value'] = np.array(data['value'], dtype=float)
+
+    return (pd.DataFrame(data, columns=_COLUMN_ORDER))
 
 
 #######################################################
 # API interface
 #######################################################
+# Replaces any existing item filter called name
+def _set_item_filter(api_request, name, value):
+    item_filter_vals = api_request['itemFilter']
+    item_filter_vals = [x for x in item_filter_vals if not x['name'] == name]
+    item_filter_vals.append({'name': name, 'value': value})
+    api_request['itemFilter'] = item_filter_vals
+
+
+# Times in GMT of the form "YYYY-MM-DDTHH:MM:SS.SSSZ"
+def _time_str(time):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + "Z"
+
+
+def _parse_time_str(time_str):
+    return dt.strptime(time_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _now_str():
+    return _time_str(dt.utcnow())
+
+
+# The end of the harvested range: --end-time, or else now.
+# Pinning it keeps the requests (and so the cache keys) stable.
+def _end_str(opts):
+    return opts.end_time or _now_str()
+
+
+# Fetches the first page of the API request and returns the
+# number of pages together with the page itself, so that the
+# page's items are not thrown away and re-requested later.
+def get_first_page(opts, api_request):
+    fetch_page = get_fetcher(opts).fetch_page
+    first_page = _fetch_pages(opts, lambda i: fetch_page(api_request, i), [1], False)[0]
+    if first_page is None:
+        raise fetcher.FetchError("Could not fetch the first page")
+    return int(first_page['paginationOutput']['totalPages']), first_page
+
+
 def get_number_pages(opts, api_request):
-    return int(_get_page(opts, api_request)['paginationOutput']['totalPages'])
+    return get_first_page(opts, api_request)[0]
+
+
+# The number of Finding API requests made so far with these options
+def get_request_count(opts):
+    return get_fetcher(opts).n_requests
 
 
 # This gets up to 100 pages of items matching the API request
 # Since each page can have up to 100 items, this call returns a maximum of
-# 10,000 listings. This limit is enforced by the ebay API
-def get_all_100(opts, api_request):
-    num_pages = get_number_pages(opts, api_request)
+# 10,000 listings. This limit is enforced by the ebay API.
+# With opts.workers > 1 the pages are fetched concurrently (at most
+# opts.rate requests per second); the output stays in page order.
+# Pass first_page if page 1 of this request has already been fetched.
+def get_all_100(opts, api_request, first_page=None):
+    return _get_relevant_data(_get_100_items(opts, api_request, first_page))
+
+
+# The items of all the pages in one list, in page order
+def _page_items(pages):
+    items = []
+    for listings in pages:
+        if listings is not None and 'item' in listings.get('searchResult', {}):
+            items += listings['searchResult']['item']
+    return items
+
+
+# The raw items of get_all_100, before extraction
+def _get_100_items(opts, api_request, first_page=None):
+    if first_page is None:
+        num_pages, first_page = get_first_page(opts, api_request)
+    else:
+        num_pages = int(first_page['paginationOutput']['totalPages'])
 
     if num_pages > 100:
         num_pages = 100
 
-    ##
-    ##
-    # num_pages=2
-    ##
-    ##
-
-    # Get the data from all the pages
-    data_ls = []
-    for i in range(1, num_pages + 1):
-        print(int(float(i) / num_pages * 100), "% complete.")
-
-        listings = _get_page(opts, api_request, i)
+    # Get the data from the remaining pages
+    pages = [first_page]
+    fetch_page = get_fetcher(opts).fetch_page
+    pages += _fetch_pages(opts, lambda i: fetch_page(api_request, i),
+                          range(2, num_pages + 1))
 
-        if 'searchResult' in listings:
-            data_ls.append(_get_relevant_data(listings['searchResult']['item']))
-
-    # Combine all the data frames into one:
-    return pd.concat(data_ls)
+    return _page_items(pages)
 
 
 # Get all listings that ended before the input datetime
 # GMT of the form "YYYY-MM-DDTHH:MM:SS.SSSZ"
 def get_100_before(opts, api_request, datetime_str):
-    item_filter_vals = api_request['itemFilter']
-    item_filter_vals = [x for x in item_filter_vals if not x['name']=='EndTimeTo']
-    item_filter_vals.append({'name': 'EndTimeTo', 'value': datetime_str})
-    api_request['itemFilter'] = item_filter_vals
+    _set_item_filter(api_request, 'EndTimeTo', datetime_str)
 
     return get_all_100(opts, api_request)
 
@@ -190,50 +347,165 @@ def get_100_before(opts, api_request, datetime_str):
 def get_100_after(opts, api_request, datetime_str):
     item_filter_vals = api_request['itemFilter']
     item_filter_vals = [x for x in item_filter_vals if not x['name']=='EndTimeTo']
-    item_filter_vals.append({'name': 'EndTimeFrom', 'value': datetime_str})
     api_request['itemFilter'] = item_filter_vals
+    _set_item_filter(api_request, 'EndTimeFrom', datetime_str)
 
     return get_all_100(opts, api_request)
 
+
+# Get every listing that ended after the input datetime, i.e. the
+# get_100_after filter without the 10,000 item limit: when there
+# are more than 100 pages the calls are chained as in get_all.
+def get_all_after(opts, api_request, datetime_str):
+    _set_item_filter(api_request, 'EndTimeTo', _end_str(opts))
+    _set_item_filter(api_request, 'EndTimeFrom', datetime_str)
+
+    return get_all(opts, api_request)
+
 # This function gets around the ebay api limitation of 10,000 items
 # by making multiple api calls until all items are fetched. This
 # can take a while depending on how many items meet the search
 # criteria specified by api_request.
-def get_all(opts, api_request):
-    # Get the initial number of pages
+# If first_page is given, it must be page 1 of api_request as it
+# stands (see __main__), and it is used instead of fetching again.
+def get_all(opts, api_request, first_page=None):
+    items = []
+    for batch in _iter_all_items(opts, api_request, first_page):
+        items += batch
 
-    # Get the current time
-    now = dt.utcnow()
-    now_str = now.isoformat("T")[:-3] + "Z"
+    # Extract all the data into one frame:
+    return _get_relevant_data(items)
 
-    time_str = now_str
 
-    item_filter_vals = api_request['itemFilter']
-    item_filter_vals = [x for x in item_filter_vals if not x['name']=='EndTimeTo']
-    item_filter_vals.append({'name': 'EndTimeTo', 'value': now_str})
-    api_request['itemFilter'] = item_filter_vals
+# Yields the raw items of get_all one 100-page call at a time
+def _iter_all_items(opts, api_request, first_page=None):
+    if first_page is None:
+        # Fix the end of the range at the current time
+        _set_item_filter(api_request, 'EndTimeTo', _end_str(opts))
 
-    # Get the total number of pages of listings
-    num_pages = get_number_pages(opts, api_request)
+        # Get the total number of pages of listings
+        num_pages, first_page = get_first_page(opts, api_request)
+    else:
+        num_pages = int(first_page['paginationOutput']['totalPages'])
 
     # The number of calls required to get all the pages is the
     # ceiling of the number of pages divided by 100 (e.g. 463 pages
     # requires 5 api calls each fetching (100, 100, 100, 100, 63) pages.
     num_calls = int( ceil( num_pages/100.0 ) )
 
-    # Make the first call:
+    # Make the first call, reusing the first page:
     print("Call 1 of", num_calls, ":")
-    data = get_100_before(opts, api_request, now_str)
+    items = _get_100_items(opts, api_request, first_page)
+    yield items
 
     # Loop api calls to get all data:
-    data_ls = [data]
     for i in range(1, num_calls):
+        if not items:
+            break
         print("Call", 1+i, "of" , num_calls, ":")
-        oldest_str = data_ls[i-1]['endTime'].iloc[-1]
-        data_ls.append(get_100_before(opts, api_request, oldest_str))
-    # return pd.concat(data_ls)
+        oldest_str = items[-1]['listingInfo']['endTime']
+        _set_item_filter(api_request, 'EndTimeTo', oldest_str)
+        items = _get_100_items(opts, api_request)
+        yield items
+
+
+#######################################################
+# Incremental harvest
+#######################################################
+
+# Fetches only the listings that ended after the high-water mark,
+# the endTime and itemId of the newest listing already ingested
+# (see ListingStore.high_water_mark). EndTimeFrom is inclusive,
+# so the listing at the mark itself is dropped here.
+def get_new(opts, api_request, mark):
+    data = get_all_after(opts, api_request, mark['endTime'])
+    return data[data['itemId'].astype(str) != mark['itemId']]
+
 
-    return pd.concat(data_ls)
+#######################################################
+# Sharded harvest
+#######################################################
+
+# A copy of api_request restricted to listings that ended
+# between start_str and end_str
+def _window_request(api_request, start_str, end_str):
+    window = dict(api_request)
+    _set_item_filter(window, 'EndTimeFrom', start_str)
+    _set_item_filter(window, 'EndTimeTo', end_str)
+    return window
+
+
+# Splits [start_str, end_str] into windows that each have at most
+# 100 pages, so every window can be harvested independently.
+# The range is first cut into n_windows equal parts; any part
+# that still has more than 100 pages is bisected and probed again.
+# Returns a list of (window api_request, first page) pairs; the
+# probe of each window doubles as its first page. A probe that still
+# fails after the retries raises a FetchError.
+def plan_windows(opts, api_request, start_str, end_str, n_windows=8,
+                 min_width=timedelta(seconds=1)):
+    start, end = _parse_time_str(start_str), _parse_time_str(end_str)
+    width = (end - start) / max(1, n_windows)
+    bounds = [(start + i * width, start + (i + 1) * width) for i in range(n_windows)]
+    bounds[-1] = (bounds[-1][0], end)
+
+    fetch_page = get_fetcher(opts).fetch_page
+
+    windows = []
+    while bounds:
+        requests = [_window_request(api_request, _time_str(lo), _time_str(hi))
+                    for lo, hi in bounds]
+        probes = _fetch_pages(opts, lambda i: fetch_page(requests[i]),
+                              range(len(requests)), verbose=False)
+
+        to_split = []
+        for (lo, hi), request, probe in zip(bounds, requests, probes):
+            if probe is None:
+                # Skipping the window would leave a hole in the harvest
+                raise fetcher.FetchError("Could not probe the window %s - %s"
+                                         % (_time_str(lo), _time_str(hi)))
+
+            num_pages = int(probe['paginationOutput']['totalPages'])
+            if num_pages > 100 and hi - lo > min_width:
+                mid = lo + (hi - lo) / 2
+                to_split += [(lo, mid), (mid, hi)]
+            else:
+                if num_pages > 100:
+                    print("Warning: window", _time_str(lo), "has", num_pages, "pages")
+                windows.append((request, probe))
+        bounds = to_split
+
+    return windows
+
+
+# Harvests every listing that ended between start_str and end_str
+# (by default the last 90 days, which is as far back as the
+# Finding API keeps completed items). Instead of chaining 100-page
+# calls, the range is split into independent windows up front
+# (see plan_windows) and the pages of all windows are fetched in
+# parallel. Listings on window boundaries are returned only once.
+def get_all_sharded(opts, api_request, start_str=None, end_str=None):
+    if end_str is None:
+        end_str = _end_str(opts)
+    if start_str is None:
+        start_str = _time_str(_parse_time_str(end_str) - timedelta(days=90))
+
+    windows = plan_windows(opts, api_request, start_str, end_str, opts.shards)
+    print("Harvesting", len(windows), "windows")
+
+    # Every (window, page) pair is an independent task
+    tasks = []
+    for w, (request, first_page) in enumerate(windows):
+        num_pages = min(100, int(first_page['paginationOutput']['totalPages']))
+        tasks += [(w, i) for i in range(2, num_pages + 1)]
+
+    fetch_page = get_fetcher(opts).fetch_page
+    pages = _fetch_pages(opts, lambda t: fetch_page(windows[t[0]][0], t[1]), tasks)
+
+    data = _get_relevant_data(_page_items([first_page for request, first_page in windows] + pages))
+    data = data.drop_duplicates('itemId')
+
+    return data.sort_values('endTime', ascending=False)
 
 # TODO:
 # Get a an item by id:
@@ -244,33 +516,49 @@ def get_all(opts, api_request):
 # Preprocessing
 #######################################################
 
+# Lookup tables for the free shipping column and for
+# simplifying listing types to Auction or Fixed Price
+SHIPPING_IS_FREE = {'Calculated': False,
+                    'Flat': False,
+                    'FreePickup': False,
+                    'FlatDomesticCalculatedInternational': False,
+                    'CalculatedDomesticFlatInternational': False,
+                    'NotSpecified': False,
+                    'Free': True}
+
+SIMPLE_LISTING_TYPES = {'Auction': 'Auction',
+                        'AuctionWithBIN': 'Auction',
+                        'FixedPrice': 'FixedPrice',
+                        'StoreInventory': 'FixedPrice'}
+
+
+# Maps a whole column through a lookup table. Values missing
+# from the table become 'NaN', with one warning for the column.
+def _map_column(column, table, name):
+    known = column.isin(list(table))
+    mapped = column.map(table)
+
+    n_unknown = len(column) - int(known.sum())
+    if n_unknown:
+        print("Warning:", n_unknown, "invalid", name, "values!")
+        mapped = mapped.astype(object).where(known, 'NaN')
+
+    return mapped
+
+
 # Add a free shipping column
 def is_free_shipping(shippingType):
-    if shippingType in ['Calculated', 'Flat',
-                        'FreePickup', 'FlatDomesticCalculatedInternational',
-                        'CalculatedDomesticFlatInternational', 'NotSpecified']:
-        return (False)
-    elif shippingType == 'Free':
-        return (True)
-    else:
-        print("Warning: invalid shipping type!")
-        return ('NaN')
+    return SHIPPING_IS_FREE.get(shippingType, 'NaN')
 
 
 # Simplify listing types to Auction or Fixed Price
 def simplify_listing_type(listing_type):
-    if listing_type in ['Auction', 'AuctionWithBIN']:
-        return ('Auction')
-    elif listing_type in ['FixedPrice', 'StoreInventory']:
-        return ('FixedPrice')
-    else:
-        print("Warning: invalid listing type!")
-        return ('NaN')
+    return SIMPLE_LISTING_TYPES.get(listing_type, 'NaN')
 
 
 def preproc(data):
-    data['isShippingFree'] = [is_free_shipping(ship_type) for ship_type in data.loc[:, 'shippingType']]
-    data['listingType'] = [simplify_listing_type(list_type) for list_type in data.loc[:, 'listingType']]
+    data['isShippingFree'] = _map_column(data['shippingType'], SHIPPING_IS_FREE, 'shipping type')
+    data['listingType'] = _map_column(data['listingType'], SIMPLE_LISTING_TYPES, 'listing type')
 
     new_col_order = ['itemId',
                      'title',
@@ -305,37 +593,126 @@ def preproc(data):
 
     data = data[new_col_order]
 
-    return (data)
+    return (apply_schema(data, LISTING_DTYPES))
 
 
 
 
 
 
+#######################################################
+# Streaming harvest
+#######################################################
+
+# The peak resident set size of this process so far, in MB
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes on Linux
+    return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0
+
+
+# Like get_all, but yields one preprocessed frame per 100-page call
+# instead of building the whole history in memory. The listing each
+# call starts from (the previous call's oldest) is only yielded once.
+def iter_all(opts, api_request, first_page=None):
+    previous_ids = set()
+    for items in _iter_all_items(opts, api_request, first_page):
+        data = preproc(_get_relevant_data(items))
+        data = data[~data['itemId'].isin(previous_ids)]
+        previous_ids = set(data['itemId'])
+
+        if len(data):
+            yield data
+
+
+# Appends frames to a CSV file, writing the header only once
+class CsvChunkWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def __call__(self, data):
+        data.to_csv(self.path, mode='w' if self.header else 'a', header=self.header,
+                    na_rep="NA", index=False, encoding='utf-8')
+        self.header = False
+
+
+# Streams every listing of get_all through extraction and preproc
+# into each of the writers (callables taking one frame, such as
+# ListingStore.upsert or a CsvChunkWriter). At most one 100-page
+# call is held in memory at a time, so memory use does not grow
+# with the number of calls. Returns the number of listings written.
+def harvest_to_disk(opts, api_request, writers, first_page=None):
+    n_rows = 0
+    for data in iter_all(opts, api_request, first_page):
+        for write in writers:
+            write(data)
+        n_rows += len(data)
+        print("Written", n_rows, "listings, peak RSS %.1f MB" % peak_rss_mb())
+
+    return n_rows
+
+
 #######################################################
 # Building the database
 #######################################################
-# TODO: use SQL database
 if __name__ == "__main__":
     print("Finding samples for SDK version %s" % ebaysdk.get_version())
     (opts, args) = init_options()
 
     api_request = get_api_dict()
+    store = ListingStore()
 
-    # Save one page for reference
-    with open('Documents/PageExample.txt', 'w') as fout:
-        pp(_get_page(opts, api_request), fout)
-
-    # Get number of pages of entries
-    num_pages = get_number_pages(opts, api_request)
-    print("Number of pages:", num_pages)
-    print("Number of entries:", 100 * num_pages)
+    mark = store.high_water_mark() if opts.incremental else None
+    if opts.incremental and mark is None:
+        print("No high-water mark found, harvesting everything.")
 
     # Get all of the listings in a data frame
-    data = get_all(opts, api_request)
-
-    # Preprocess the data
-    data = preproc(data)
-
-    # Print the data frame to a file
-    data.to_csv("Data/ebay_data.csv", na_rep="NA", index=False, encoding='utf-8')
+    if mark is not None:
+        print("Fetching listings that ended after", mark['endTime'])
+        data = get_new(opts, api_request, mark)
+    elif opts.sharded:
+        # The windows are probed by get_all_sharded itself
+        data = get_all_sharded(opts, api_request)
+    else:
+        _set_item_filter(api_request, 'EndTimeTo', _end_str(opts))
+
+        # Get number of pages of entries, and the first page
+        num_pages, first_page = get_first_page(opts, api_request)
+        print("Number of pages:", num_pages)
+        print("Number of entries:", 100 * num_pages)
+
+        # Save one page for reference
+        with open('Documents/PageExample.txt', 'w') as fout:
+            pp(first_page, fout)
+
+        if opts.stream:
+            n_rows = harvest_to_disk(opts, api_request, [store.upsert], first_page)
+            print("Streamed", n_rows, "listings")
+            data = None
+        else:
+            data = get_all(opts, api_request, first_page)
+
+    if data is not None:
+        print("Fetched", len(data), "listings")
+
+    if data is not None and len(data):
+        # Preprocess the data
+        data = preproc(data)
+
+        # Add the listings to the store, replacing older copies
+        store.upsert(data)
+
+    print("Listings stored:", store.count())
+
+    # Export the whole store, whichever way it was harvested
+    if opts.csv:
+        print("Exported", store.export_csv(opts.csv), "listings to", opts.csv)
+
+    print("Requests made:", get_request_count(opts))
+    print("Peak RSS: %.1f MB" % peak_rss_mb())
+    get_fetcher(opts).print_summary()
+    if get_fetcher(opts).cache is not None:
+        print("Response cache hits:", get_fetcher(opts).cache.hits)
+    if opts.daily_limit:
+        print("Calls left today:", get_fetcher(opts).budget.remaining())
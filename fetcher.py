@@ -0,0 +1,460 @@
+import heapq
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+from ebaysdk.finding import Connection as finding
+from ebaysdk.exception import ConnectionError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+BUDGET_PATH = "Data/call_budget.json"
+
+# eBay's default Finding API quota
+DAILY_CALL_LIMIT = 5000
+
+
+#######################################################
+# Errors
+#######################################################
+
+class FetchError(Exception):
+    pass
+
+
+# eBay refused the call because the call rate is too high
+class ThrottledError(FetchError):
+    pass
+
+
+# The daily call budget is used up; retrying will not help
+class BudgetExhaustedError(FetchError):
+    pass
+
+
+# ebaysdk reports throttling as an API error with this id
+_THROTTLE_ERRORS = ['10001', 'exceeded the number of times']
+
+
+def _is_throttle(error):
+    message = str(error)
+    return any(e in message for e in _THROTTLE_ERRORS)
+
+
+# The errors worth retrying: throttling and connection problems.
+# Anything else (a bad config file, a malformed request) fails the
+# same way every time.
+RETRY_ERRORS = (ThrottledError, ConnectionError,
+                requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+#######################################################
+# Rate limiting
+#######################################################
+
+# Token bucket shared by all the threads of a fetcher: calls
+# are paced at rate per second, with bursts of up to capacity
+# calls. rate=None disables the pacing. When eBay throttles a
+# call, the rate is halved and every caller pauses; it then
+# creeps back up to max_rate as calls succeed.
+class TokenBucket(object):
+    def __init__(self, rate=None, capacity=1.0, min_rate=0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                delay = self.paused_until - now
+
+                if delay <= 0 and self.rate is None:
+                    return
+
+                if delay <= 0:
+                    self.tokens = min(self.capacity,
+                                      self.tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+
+    def throttle(self, pause=1.0):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.time() + pause)
+            if self.rate is not None:
+                self.rate = max(self.min_rate, self.rate / 2.0)
+
+    def success(self):
+        if self.rate is None or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate)
+
+
+# Counts the calls made per (UTC) day, persisted in a small JSON
+# file so that separate runs (ebay.py, clock.py) share the quota.
+# Each take holds an exclusive lock on path + '.lock' (where fcntl
+# is available) while it reads and rewrites the file, and the file
+# is replaced atomically, so concurrent processes neither lose
+# counts nor read a half-written file. limit=None disables the
+# budget.
+class CallBudget(object):
+    def __init__(self, limit=DAILY_CALL_LIMIT, path=BUDGET_PATH):
+        self.limit = limit
+        self.path = path
+        self._lock = threading.Lock()
+        self.day, self.used = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fin:
+                state = json.load(fin)
+            return state['day'], state['used']
+        except (IOError, OSError, ValueError, KeyError):
+            return None, 0
+
+    def _save(self):
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fout:
+            json.dump({'day': self.day, 'used': self.used}, fout)
+        os.rename(tmp, self.path)
+
+    # Takes one call from today's budget; False if none are left
+    def take(self):
+        if self.limit is None:
+            return True
+
+        with self._lock:
+            with open(self.path + '.lock', 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+
+                today = datetime.utcnow().strftime('%Y-%m-%d')
+                day, used = self._load()
+                if day != today:
+                    day, used = today, 0
+                if used >= self.limit:
+                    self.day, self.used = day, used
+                    return False
+
+                self.day, self.used = day, used + 1
+                self._save()
+                return True
+
+    def remaining(self):
+        if self.limit is None:
+            return None
+        day, used = self._load()
+        if day != datetime.utcnow().strftime('%Y-%m-%d'):
+            used = 0
+        return max(0, self.limit - used)
+
+
+#######################################################
+# Connection pool
+#######################################################
+
+# ebaysdk closes its HTTP session after every response, which
+# throws away the keep-alive connection. This keeps it open so
+# the next page reuses the TCP/TLS connection.
+class _KeepAliveConnection(finding):
+    def process_response(self, parse_response=True):
+        close = self.session.close
+        self.session.close = lambda: None
+        try:
+            super(_KeepAliveConnection, self).process_response(parse_response)
+        finally:
+            self.session.close = close
+
+
+# Owns up to max_connections Finding connections, which are
+# created on demand and handed out to one thread at a time.
+# Every page records the connection setup time (zero when a
+# connection was reused) and the request time in self.stats.
+# ebaysdk only opens the TCP/TLS connection inside the first
+# request made on it, so that request is flagged first_use and
+# summarized apart from the requests on a reused connection.
+# With a ResponseCache, cached pages are served from disk, and
+# with offline=True nothing else is requested. Requests that go
+# to eBay are paced by the TokenBucket and counted against the
+# CallBudget.
+class FindingFetcher(object):
+    def __init__(self, opts, max_connections=1, cache=None, offline=False,
+                 bucket=None, budget=None):
+        self.opts = opts
+        self.cache = cache
+        self.offline = offline
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.budget = budget if budget is not None else CallBudget(None)
+        self.max_connections = max(1, max_connections)
+        self.n_connections = 0
+        self.n_requests = 0
+        self.stats = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        api = _KeepAliveConnection(debug=self.opts.debug, appid=self.opts.appid,
+                                   config_file=self.opts.yaml, warnings=True,
+                                   domain=self.opts.domain)
+        if not self.opts.https:
+            api.config.set('https', False, force=True)
+        return api
+
+    # Returns (connection, setup time in seconds)
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait(), 0.0
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self.n_connections < self.max_connections
+            if create:
+                self.n_connections += 1
+
+        if not create:
+            return self._idle.get(), 0.0
+
+        start = time.time()
+        try:
+            api = self._connect()
+            api.first_use = True
+            return api, time.time() - start
+        except Exception:
+            with self._lock:
+                self.n_connections -= 1
+            raise
+
+    def _release(self, api):
+        self._idle.put(api)
+
+    # Returns the full response dict for one page of
+    # findCompletedItems, or None if the call failed.
+    def get_page(self, api_request, page_number=1):
+        try:
+            return self.fetch_page(api_request, page_number)
+        except Exception as e:
+            print(e)
+
+    # Like get_page, but raises a FetchError (ThrottledError,
+    # BudgetExhaustedError) or the underlying error on failure.
+    def fetch_page(self, api_request, page_number=1):
+        api_request = dict(api_request)
+        api_request['paginationInput'] = {"entriesPerPage": 100,
+                                          "pageNumber": page_number}
+
+        if self.cache is not None:
+            response = self.cache.get(api_request, page_number)
+            if response is not None:
+                return response
+
+        if self.offline:
+            raise FetchError("Page %d is not cached (offline)" % page_number)
+
+        response = self._request(api_request, page_number)
+
+        if self.cache is not None:
+            self.cache.put(api_request, page_number, response)
+
+        return response
+
+    def _request(self, api_request, page_number):
+        self.bucket.wait()
+        if not self.budget.take():
+            raise BudgetExhaustedError("The daily budget of %d calls is used up"
+                                       % self.budget.limit)
+
+        api, setup = self._acquire()
+        first_use, api.first_use = getattr(api, 'first_use', False), False
+        start = time.time()
+        try:
+            with self._lock:
+                self.n_requests += 1
+            response = api.execute('findCompletedItems', api_request).dict()
+        except ConnectionError as e:
+            if _is_throttle(e):
+                self.bucket.throttle()
+                raise ThrottledError(str(e))
+            raise
+        finally:
+            request = time.time() - start
+            with self._lock:
+                self.stats.append({'page': page_number,
+                                   'setup': setup,
+                                   'first_use': first_use,
+                                   'request': request})
+            self._release(api)
+
+        # API errors such as throttling come back as a normal
+        # response with ack set to Failure
+        if response.get('ack') == 'Failure':
+            error = response.get('errorMessage', {}).get('error', {})
+            if isinstance(error, list):
+                error = error[0]
+            message = "Error %s: %s" % (error.get('errorId'), error.get('message'))
+            if _is_throttle(message):
+                self.bucket.throttle()
+                raise ThrottledError(message)
+            raise FetchError(message)
+
+        self.bucket.success()
+        return response
+
+    # Total and mean connection setup and request times. The
+    # requests that opened a connection (and so include the
+    # handshake) are counted apart from those that reused one.
+    def summary(self):
+        n = len(self.stats)
+        setup = sum(s['setup'] for s in self.stats)
+        first = [s['request'] for s in self.stats if s['first_use']]
+        reused = [s['request'] for s in self.stats if not s['first_use']]
+        return {'pages': n,
+                'connections': self.n_connections,
+                'setup_total': setup,
+                'first_request_total': sum(first),
+                'first_request_mean': sum(first) / len(first) if first else 0.0,
+                'request_total': sum(reused),
+                'request_mean': sum(reused) / len(reused) if reused else 0.0}
+
+    def print_summary(self):
+        s = self.summary()
+        print("%d pages over %d connections: setup %.3f s, first requests %.3f s "
+              "(%.4f s/connection), reused requests %.3f s (%.4f s/page)"
+              % (s['pages'], s['connections'], s['setup_total'],
+                 s['first_request_total'], s['first_request_mean'],
+                 s['request_total'], s['request_mean']))
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().session.close()
+            except queue.Empty:
+                break
+        self.n_connections = 0
+
+
+#######################################################
+# Page fetching
+#######################################################
+
+# Thread-safe "% complete." printer shared by the workers
+class _Progress(object):
+    def __init__(self, total, verbose=True):
+        self.total = total
+        self.count = 0
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def done(self):
+        with self._lock:
+            self.count += 1
+            if self.verbose:
+                print(int(float(self.count) / self.total * 100), "% complete.")
+
+
+# Fetches every task in tasks (e.g. page numbers) with fetch(task),
+# which returns the response dict, or raises (or returns None) on
+# failure. Up to n_workers tasks run at once. A task that fails
+# with one of the RETRY_ERRORS (or returns None) goes back in the
+# queue and is retried no sooner than after an exponential backoff
+# (retry_wait, 2 * retry_wait, ...), so the workers move on to
+# other pages meanwhile. After max_retries retries, or once the
+# call budget is used up, it is given up. Any other error stops
+# the workers and is raised again here.
+# The responses are returned in the order of tasks, with None in
+# place of any task that could not be fetched.
+def fetch_pages(fetch, tasks, n_workers=1, max_retries=3, retry_wait=1.0,
+                verbose=True):
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    progress = _Progress(len(tasks), verbose)
+
+    # (not before, attempt, index) of the tasks still to do
+    pending = [(0.0, 0, i) for i in range(len(tasks))]
+    state = {'running': 0, 'stop': False, 'error': None}
+    cond = threading.Condition()
+
+    def next_task():
+        with cond:
+            while True:
+                if state['stop'] or (not pending and not state['running']):
+                    cond.notify_all()
+                    return None
+                if pending:
+                    delay = pending[0][0] - time.time()
+                    if delay <= 0:
+                        state['running'] += 1
+                        return heapq.heappop(pending)
+                    cond.wait(delay)
+                else:
+                    cond.wait()
+
+    def worker():
+        while True:
+            task = next_task()
+            if task is None:
+                return
+            not_before, attempt, i = task
+
+            error = None
+            try:
+                response = fetch(tasks[i])
+            except BudgetExhaustedError as e:
+                print("Warning:", e)
+                response, state['stop'] = None, True
+            except RETRY_ERRORS as e:
+                response, error = None, e
+            except Exception as e:
+                response, state['stop'], state['error'] = None, True, e
+
+            with cond:
+                state['running'] -= 1
+                if response is not None:
+                    results[i] = response
+                    progress.done()
+                elif state['stop']:
+                    pass
+                elif attempt < max_retries:
+                    if verbose:
+                        print("Requeueing", tasks[i], "after error:", error)
+                    wait = retry_wait * 2 ** attempt
+                    heapq.heappush(pending, (time.time() + wait, attempt + 1, i))
+                else:
+                    print("Warning: giving up on", tasks[i], ":", error)
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(n_workers, len(tasks))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if state['error'] is not None:
+        raise state['error']
+
+    return results
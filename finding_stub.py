@@ -0,0 +1,285 @@
+#######################################################
+# Local stub of the eBay Finding API
+#
+# Serves findCompletedItems responses for a synthetic
+# set of listings so that the harvest code in ebay.py
+# can be exercised and benchmarked offline:
+#
+#   python finding_stub.py --port 8000 --items 44800
+#   python ebay.py --domain localhost:8000 --no-https --appid stub
+#######################################################
+
+from __future__ import print_function
+
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime as dt, timedelta
+from math import ceil
+from optparse import OptionParser
+from xml.sax.saxutils import escape
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+NEWEST = dt(2016, 5, 4, 0, 36, 37)
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+PARSE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+CONDITIONS = [('Used', '3000'), ('New', '1000'),
+              ('New other (see details)', '1500'),
+              ('Manufacturer refurbished', '2000'),
+              ('For parts or not working', '7000')]
+LISTING_TYPES = ['StoreInventory', 'FixedPrice', 'Auction', 'AuctionWithBIN']
+SHIPPING_TYPES = ['Free', 'Calculated', 'Flat', 'FreePickup',
+                  'FlatDomesticCalculatedInternational', 'NotSpecified']
+STARS = ['Yellow', 'Blue', 'Turquoise', 'Purple', 'Red', 'Green']
+STATES = ['EndedWithSales', 'EndedWithoutSales']
+
+
+#######################################################
+# Synthetic listings
+#######################################################
+
+# The i-th newest listing. Every field is a deterministic
+# function of i, and the shape follows Documents/PageExample.txt.
+# Some optional fields are left out on purpose, as in real data.
+def make_item(i, spacing=60):
+    end = NEWEST - timedelta(seconds=i * spacing)
+    start = end - timedelta(hours=1 + i % 240)
+    condition = CONDITIONS[i % len(CONDITIONS)]
+    price = '%.1f' % (150 + (i * 37) % 2000)
+    flag = lambda k: 'true' if (i // k) % 2 else 'false'
+
+    item = {'itemId': str(121974760109 + i),
+            'title': 'Apple MacBook Pro %d' % (i % 97),
+            'condition': {'conditionDisplayName': condition[0],
+                          'conditionId': condition[1]},
+            'country': 'US',
+            'listingInfo': {'bestOfferEnabled': flag(2),
+                            'buyItNowAvailable': flag(3),
+                            'endTime': end.strftime(TIME_FORMAT),
+                            'gift': 'false',
+                            'listingType': LISTING_TYPES[i % len(LISTING_TYPES)],
+                            'startTime': start.strftime(TIME_FORMAT)},
+            'paymentMethod': 'PayPal',
+            'primaryCategory': {'categoryId': '111422',
+                                'categoryName': 'Apple Laptops'},
+            'returnsAccepted': flag(5),
+            'sellingStatus': {'currentPrice': {'_currencyId': 'USD',
+                                               'value': price},
+                              'sellingState': STATES[(i // 7) % 2]},
+            'shippingInfo': {'expeditedShipping': flag(11),
+                             'shippingType': SHIPPING_TYPES[i % len(SHIPPING_TYPES)]},
+            'topRatedListing': flag(13)}
+
+    if i % 10:
+        item['postalCode'] = '%05d' % (i % 99999)
+    if i % 4:
+        item['productId'] = {'_type': 'ReferenceID', 'value': str(110000000 + i % 50)}
+    if i % 9:
+        item['sellingStatus']['bidCount'] = str(i % 17)
+    if i % 8:
+        item['sellerInfo'] = {'feedbackRatingStar': STARS[i % len(STARS)],
+                              'feedbackScore': str((i * 13) % 5000),
+                              'positiveFeedbackPercent': '%.1f' % (95 + i % 50 / 10.0),
+                              'topRatedSeller': flag(17)}
+
+    return item
+
+
+def _to_xml(tag, value):
+    if isinstance(value, dict):
+        attrs = ''.join(' %s="%s"' % (k[1:], escape(v))
+                        for k, v in sorted(value.items()) if k.startswith('_'))
+        if 'value' in value:
+            body = escape(value['value'])
+        else:
+            body = ''.join(_to_xml(k, v) for k, v in sorted(value.items())
+                           if not k.startswith('_'))
+        return '<%s%s>%s</%s>' % (tag, attrs, body, tag)
+
+    return '<%s>%s</%s>' % (tag, escape(value), tag)
+
+
+#######################################################
+# Request handling
+#######################################################
+
+def _find(root, name):
+    for node in root.iter():
+        if node.tag.split('}')[-1] == name:
+            yield node
+
+
+def _text(root, name, default=None):
+    for node in _find(root, name):
+        return node.text
+    return default
+
+
+# Returns (page_number, entries_per_page, end_time_from, end_time_to)
+def parse_request(body):
+    root = ET.fromstring(body)
+
+    page_number = int(_text(root, 'pageNumber', 1))
+    entries = int(_text(root, 'entriesPerPage', 100))
+
+    filters = {}
+    for node in _find(root, 'itemFilter'):
+        filters[_text(node, 'name')] = _text(node, 'value')
+
+    return (page_number, entries,
+            filters.get('EndTimeFrom'), filters.get('EndTimeTo'))
+
+
+class StubData(object):
+    def __init__(self, n_items, spacing=60):
+        self.n_items = n_items
+        self.spacing = spacing
+
+    # Index range [first, last) of the listings that ended
+    # within [end_from, end_to], newest first
+    def index_range(self, end_from=None, end_to=None):
+        first, last = 0, self.n_items
+        if end_to is not None:
+            age = (NEWEST - dt.strptime(end_to, PARSE_FORMAT)).total_seconds()
+            first = max(first, int(ceil(age / self.spacing)))
+        if end_from is not None:
+            age = (NEWEST - dt.strptime(end_from, PARSE_FORMAT)).total_seconds()
+            last = min(last, int(age // self.spacing) + 1)
+        return first, max(first, last)
+
+    def response(self, page_number, entries, end_from=None, end_to=None):
+        first, last = self.index_range(end_from, end_to)
+        total = last - first
+        total_pages = int(ceil(total / float(entries)))
+
+        # Like eBay, nothing is served beyond the 100th page
+        lo = first + (page_number - 1) * entries
+        hi = min(last, lo + entries) if page_number <= 100 else lo
+        items = ''.join(_to_xml('item', make_item(i, self.spacing))
+                        for i in range(lo, hi))
+
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<findCompletedItemsResponse '
+                'xmlns="http://www.ebay.com/marketplace/search/v1/services">'
+                '<ack>Success</ack><version>1.13.0</version>'
+                '<timestamp>%s</timestamp>'
+                '<searchResult count="%d">%s</searchResult>'
+                '<paginationOutput><pageNumber>%d</pageNumber>'
+                '<entriesPerPage>%d</entriesPerPage><totalPages>%d</totalPages>'
+                '<totalEntries>%d</totalEntries></paginationOutput>'
+                '</findCompletedItemsResponse>'
+                % (NEWEST.strftime(TIME_FORMAT), max(0, hi - lo), items,
+                   page_number, entries, total_pages, total))
+
+
+THROTTLED = ('<?xml version="1.0" encoding="UTF-8"?>'
+             '<findCompletedItemsResponse '
+             'xmlns="http://www.ebay.com/marketplace/search/v1/services">'
+             '<ack>Failure</ack><errorMessage><error><errorId>10001</errorId>'
+             '<domain>Security</domain><severity>Error</severity>'
+             '<category>System</category><message>Service call has exceeded the '
+             'number of times the operation is allowed to be called</message>'
+             '<subdomain>RateLimiter</subdomain></error></errorMessage>'
+             '<version>1.13.0</version><timestamp>%s</timestamp>'
+             '</findCompletedItemsResponse>' % NEWEST.strftime(TIME_FORMAT))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+
+        with server.lock:
+            server.n_requests += 1
+
+            # Refuse calls beyond max_rate per second, like eBay does
+            throttled = False
+            if server.max_rate:
+                now = time.time()
+                server.tokens = min(server.max_rate,
+                                    server.tokens + (now - server.last) * server.max_rate)
+                server.last = now
+                throttled = server.tokens < 1
+                if throttled:
+                    server.n_throttled += 1
+                else:
+                    server.tokens -= 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if throttled:
+            payload = THROTTLED.encode('utf-8')
+        else:
+            page_number, entries, end_from, end_to = parse_request(body)
+            with server.lock:
+                server.requests.append((page_number, end_from, end_to))
+            payload = server.data.response(page_number, entries,
+                                           end_from, end_to).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Starts a stub server on a background thread and returns it.
+# server.domain is the value to pass to ebay.py's --domain, and
+# server.n_requests counts the requests served, and server.requests
+# lists the (page number, EndTimeFrom, EndTimeTo) of every one that
+# was not throttled. With max_rate, calls beyond max_rate per
+# second get eBay's throttling error, counted in server.n_throttled.
+def serve(port=0, n_items=44800, latency=0.0, spacing=60, max_rate=None):
+    server = StubServer(('localhost', port), _Handler)
+    server.data = StubData(n_items, spacing)
+    server.latency = latency
+    server.max_rate = max_rate
+    server.tokens = max_rate or 0
+    server.last = time.time()
+    server.n_throttled = 0
+    server.n_requests = 0
+    server.requests = []
+    server.lock = threading.Lock()
+    server.domain = 'localhost:%d' % server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-p", "--port", type="int", dest="port", default=8000)
+    parser.add_option("-n", "--items", type="int", dest="items", default=44800)
+    parser.add_option("-l", "--latency", type="float", dest="latency", default=0.2,
+                      help="Seconds of simulated latency per request. [default: %default]")
+    parser.add_option("-r", "--rate", type="float", dest="rate", default=None,
+                      help="Throttle calls beyond this many per second. [default: no limit]")
+    (opts, args) = parser.parse_args()
+
+    server = serve(opts.port, opts.items, opts.latency, max_rate=opts.rate)
+    print("Serving", opts.items, "listings on", server.domain)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,168 @@
+#######################################################
+# Flat array random forest for inference
+#
+# The trees of a fitted RandomForestClassifier are
+# concatenated into a handful of contiguous arrays,
+# saved as a directory of .npy files and scored in
+# numpy, without the sklearn object graph. The .npy
+# files are uncompressed, so they can be memory-mapped
+# and their pages shared by every process that loads
+# the same forest. The probabilities are the same
+# as clf.predict_proba (with n_jobs=1): the inputs are
+# compared as float32 against the same thresholds, and
+# the normalized leaf values are summed tree by tree in
+# the same order before dividing by the number of trees.
+#######################################################
+
+import os
+import shutil
+
+import numpy as np
+
+# sklearn marks the leaves with feature -2
+_LEAF = -2
+
+_ARRAYS = ['feature', 'threshold', 'left', 'right', 'value', 'roots', 'classes',
+           'missing_left']
+
+
+# The flat forest directory that goes with a pickled model
+def flat_path(model_path):
+    return os.path.splitext(model_path)[0] + '.flat'
+
+
+class FlatForest(object):
+    def __init__(self, feature, threshold, left, right, value, roots, classes,
+                 missing_left=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.missing_left = missing_left
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    # Flattens a fitted RandomForestClassifier (single output)
+    @classmethod
+    def from_sklearn(cls, clf):
+        arrays = {'feature': [], 'threshold': [], 'left': [], 'right': [],
+                  'value': [], 'missing_left': []}
+        roots, offset = [], 0
+        n_classes = len(clf.classes_)
+
+        for estimator in clf.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left == -1
+
+            # The class probabilities of each node, normalized the
+            # way DecisionTreeClassifier.predict_proba does it
+            value = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+
+            arrays['feature'].append(np.where(leaf, _LEAF, tree.feature).astype(np.int32))
+            arrays['threshold'].append(tree.threshold.astype(np.float64))
+            arrays['left'].append(np.where(leaf, -1, tree.children_left + offset).astype(np.int32))
+            arrays['right'].append(np.where(leaf, -1, tree.children_right + offset).astype(np.int32))
+            arrays['value'].append(value / normalizer)
+            if hasattr(tree, 'missing_go_to_left'):
+                arrays['missing_left'].append(np.asarray(tree.missing_go_to_left, dtype=bool))
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        missing_left = arrays.pop('missing_left')
+        missing_left = np.concatenate(missing_left) if missing_left else None
+        arrays = dict((name, np.concatenate(parts)) for name, parts in arrays.items())
+
+        return cls(roots=np.array(roots, dtype=np.int32), classes=np.asarray(clf.classes_),
+                   missing_left=missing_left, **arrays)
+
+    # Writes one .npy file per array into the directory path. The
+    # arrays are written to a temporary directory that then takes
+    # the place of path, so a reader never sees a mix of two forests.
+    def save(self, path):
+        arrays = {'feature': self.feature, 'threshold': self.threshold,
+                  'left': self.left, 'right': self.right, 'value': self.value,
+                  'roots': self.roots, 'classes': self.classes_}
+        if self.missing_left is not None:
+            arrays['missing_left'] = self.missing_left
+
+        path = path.rstrip(os.sep)
+        tmp, old = path + '.tmp', path + '.old'
+        for stale in [tmp, old]:
+            if os.path.isdir(stale):
+                shutil.rmtree(stale)
+
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+
+        if os.path.isdir(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        if os.path.isdir(old):
+            shutil.rmtree(old)
+
+    # With mmap_mode='r' the arrays are mapped read-only from the
+    # files instead of read into memory
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays = {}
+        for name in _ARRAYS:
+            filename = os.path.join(path, name + '.npy')
+            if os.path.isfile(filename):
+                arrays[name] = np.load(filename, mmap_mode=mmap_mode)
+        arrays['classes'] = np.array(arrays['classes'])
+        return cls(**arrays)
+
+    # The leaf reached by every sample in every tree, as an
+    # (n_trees, n_samples) array of node indices. All the trees
+    # are walked at once, one level per step, and each step only
+    # moves the (tree, sample) pairs that are not at a leaf yet,
+    # so the work is the total path length, not the depth times
+    # the number of pairs.
+    def apply(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        X = X.ravel()
+
+        node = np.repeat(self.roots, n_samples)
+        offset = np.tile(np.arange(n_samples) * n_features, self.n_trees)
+        active = np.arange(len(node))
+
+        while len(active):
+            current = node[active]
+            feature = self.feature[current]
+            internal = feature != _LEAF
+            active, current, feature = active[internal], current[internal], feature[internal]
+
+            x = X[offset[active] + feature]
+            go_left = x <= self.threshold[current]
+            if self.missing_left is not None:
+                go_left = np.where(np.isnan(x), self.missing_left[current], go_left)
+
+            node[active] = np.where(go_left, self.left[current], self.right[current])
+
+        return node.reshape(self.n_trees, n_samples)
+
+    def predict_proba(self, X, batch_size=10000):
+        X = np.asarray(X, dtype=np.float32)
+        proba = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float64)
+
+        for start in range(0, X.shape[0], batch_size):
+            leaves = self.apply(X[start:start + batch_size])
+            batch = proba[start:start + batch_size]
+            for tree_leaves in leaves:
+                batch += self.value[tree_leaves]
+
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
@@ -0,0 +1,154 @@
+#######################################################
+# Local listing store
+#
+# The harvested listings live in one SQLite table keyed
+# on itemId, with indexes on the columns the consumers
+# filter by. Rows are upserted, so re-harvesting a
+# listing replaces it instead of duplicating it.
+#######################################################
+
+import sqlite3
+
+import pandas as pd
+
+from schema import apply_schema, LISTING_DTYPES
+
+STORE_PATH = "Data/ebay_listings.sqlite"
+
+# Column name and SQLite type, in the order of ebay.preproc
+COLUMNS = [('itemId', 'TEXT PRIMARY KEY'),
+           ('title', 'TEXT'),
+           ('productId_type', 'TEXT'),
+           ('productId_value', 'TEXT'),
+           ('conditionDisplayName', 'TEXT'),
+           ('conditionId', 'TEXT'),
+           ('categoryId', 'TEXT'),
+           ('categoryName', 'TEXT'),
+           ('startTime', 'TEXT'),
+           ('endTime', 'TEXT'),
+           ('postalCode', 'TEXT'),
+           ('country', 'TEXT'),
+           ('listingType', 'TEXT'),
+           ('bidCount', 'INTEGER'),
+           ('buyItNowAvailable', 'BOOLEAN'),
+           ('bestOfferEnabled', 'BOOLEAN'),
+           ('gift', 'BOOLEAN'),
+           ('paymentMethod', 'TEXT'),
+           ('expeditedShipping', 'BOOLEAN'),
+           ('shippingType', 'TEXT'),
+           ('isShippingFree', 'BOOLEAN'),
+           ('returnsAccepted', 'BOOLEAN'),
+           ('topRatedListing', 'BOOLEAN'),
+           ('feedbackRatingStar', 'TEXT'),
+           ('feedbackScore', 'INTEGER'),
+           ('positiveFeedbackPercent', 'REAL'),
+           ('topRatedSeller', 'TEXT'),
+           ('value', 'REAL'),
+           ('sellingState', 'TEXT')]
+
+COLUMN_NAMES = [name for name, sql_type in COLUMNS]
+BOOL_COLUMNS = [name for name, sql_type in COLUMNS if sql_type == 'BOOLEAN']
+INDEXED_COLUMNS = ['endTime', 'productId_value', 'sellingState']
+
+
+class ListingStore(object):
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS listings (%s)"
+                              % ", ".join("%s %s" % c for c in COLUMNS))
+            for col in INDEXED_COLUMNS:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS idx_%s ON listings (%s)"
+                                  % (col, col))
+
+    # Inserts the rows of a preprocessed listing frame (see
+    # ebay.preproc), replacing any stored row with the same itemId.
+    # 'NA' placeholders and NaN are stored as NULL.
+    def upsert(self, data, chunksize=10000):
+        data = data[COLUMN_NAMES]
+        data = data.astype(object).where(data.notnull() & (data != 'NA'), None)
+        data['itemId'] = data['itemId'].astype(str)
+
+        sql = ("INSERT OR REPLACE INTO listings (%s) VALUES (%s)"
+               % (", ".join(COLUMN_NAMES), ", ".join("?" * len(COLUMN_NAMES))))
+        rows = data.values.tolist()
+        with self.conn:
+            for i in range(0, len(rows), chunksize):
+                self.conn.executemany(sql, rows[i:i + chunksize])
+
+        return len(rows)
+
+    # The SELECT statement and parameters for read and iter_read
+    def _query(self, columns, start, end, selling_state, product_id):
+        columns = list(columns) if columns is not None else COLUMN_NAMES
+
+        where, params = [], []
+        for col, op, val in [('endTime', '>=', start), ('endTime', '<=', end),
+                             ('sellingState', '=', selling_state),
+                             ('productId_value', '=', product_id)]:
+            if val is not None:
+                where.append("%s %s ?" % (col, op))
+                params.append(val)
+
+        sql = "SELECT %s FROM listings" % ", ".join(columns)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY endTime DESC"
+
+        return sql, params
+
+    # Reads the stored listings as a data frame (typed as in
+    # schema.LISTING_DTYPES), newest first.
+    # Only the requested columns are read, and only listings
+    # that ended within [start, end] (GMT strings of the form
+    # "YYYY-MM-DDTHH:MM:SS.SSSZ"), optionally restricted to one
+    # selling state and/or product id.
+    def read(self, columns=None, start=None, end=None,
+             selling_state=None, product_id=None):
+        sql, params = self._query(columns, start, end, selling_state, product_id)
+        data = pd.read_sql_query(sql, self.conn, params=params)
+
+        return apply_schema(data, LISTING_DTYPES)
+
+    # Like read, but yields the listings in frames of up to
+    # chunksize rows, so they never all have to be in memory
+    def iter_read(self, columns=None, start=None, end=None,
+                  selling_state=None, product_id=None, chunksize=100000):
+        sql, params = self._query(columns, start, end, selling_state, product_id)
+        for data in pd.read_sql_query(sql, self.conn, params=params, chunksize=chunksize):
+            yield apply_schema(data, LISTING_DTYPES)
+
+    # Writes the stored listings (or those selected as in read) to
+    # a CSV file, newest first, one chunk at a time. Missing values
+    # are written as NA. Returns the number of listings written.
+    def export_csv(self, path, columns=None, start=None, end=None,
+                   selling_state=None, product_id=None, chunksize=100000):
+        n_rows = 0
+        for data in self.iter_read(columns, start, end, selling_state, product_id, chunksize):
+            data.to_csv(path, mode='a' if n_rows else 'w', header=not n_rows,
+                        na_rep="NA", index=False, encoding='utf-8')
+            n_rows += len(data)
+
+        # An empty store still gets the header
+        if not n_rows:
+            columns = list(columns) if columns is not None else COLUMN_NAMES
+            pd.DataFrame(columns=columns).to_csv(path, index=False, encoding='utf-8')
+
+        return n_rows
+
+    # The endTime and itemId of the newest stored listing,
+    # or None if the store is empty
+    def high_water_mark(self):
+        row = self.conn.execute("SELECT endTime, itemId FROM listings "
+                                "ORDER BY endTime DESC, itemId DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return {'endTime': row[0], 'itemId': row[1]}
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,103 @@
+#######################################################
+# Streaming evaluation of the live predictions
+#
+# Each tick only scores the listings that have not been
+# seen before (a bounded LRU set of itemIds), and the
+# running metrics are kept over a sliding time window
+# as summed confusion counts and score histograms, so
+# a tick costs the same however long the feed has run.
+#######################################################
+
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+import numpy as np
+
+# How far back the running metrics look
+WINDOW = timedelta(hours=1)
+
+
+# The most recently seen itemIds, up to max_size of them
+class SeenItems(object):
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def _touch(self, item_id):
+        self._items.pop(item_id, None)
+        self._items[item_id] = True
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    # A boolean mask of the ids that have not been seen
+    def new_mask(self, item_ids):
+        return np.array([item_id not in self._items for item_id in item_ids], dtype=bool)
+
+    # Marks the ids as seen
+    def add(self, item_ids):
+        for item_id in item_ids:
+            self._touch(item_id)
+
+
+# Confusion counts and a ROC AUC over the batches added in the last
+# window. The AUC is approximated from histograms of the scores
+# (the probability of classes[1]) of the actual positives and
+# negatives, with n_bins bins; scores in the same bin count as ties.
+class WindowEvaluator(object):
+    def __init__(self, classes=(0, 1), window=WINDOW, n_bins=200):
+        self.classes = np.asarray(classes)
+        self.window = window
+        self.n_bins = n_bins
+        self.cmat = np.zeros((len(classes), len(classes)), dtype=np.int64)
+        self.hist = np.zeros((2, n_bins), dtype=np.int64)
+        self._batches = deque()
+
+    def _expire(self, now):
+        while self._batches and self._batches[0][0] < now - self.window:
+            timestamp, cmat, hist = self._batches.popleft()
+            self.cmat -= cmat
+            self.hist -= hist
+
+    # Adds one scored batch: the true and predicted labels and the
+    # scores of classes[1]. Listings whose true or predicted label is
+    # not one of the classes (such as an unknown encoded label, -1)
+    # are left out.
+    def add(self, timestamp, y, labels, scores):
+        y, labels, scores = np.asarray(y), np.asarray(labels), np.asarray(scores)
+        known = np.isin(y, self.classes) & np.isin(labels, self.classes)
+        y, labels, scores = y[known], labels[known], scores[known]
+
+        n_classes = len(self.classes)
+        true = np.searchsorted(self.classes, y)
+        pred = np.searchsorted(self.classes, labels)
+        cmat = np.bincount(true * n_classes + pred,
+                           minlength=n_classes ** 2).reshape(n_classes, n_classes)
+
+        bins = np.minimum((scores * self.n_bins).astype(int), self.n_bins - 1)
+        positive = (true == 1).astype(int)
+        hist = np.bincount(positive * self.n_bins + bins,
+                           minlength=2 * self.n_bins).reshape(2, self.n_bins)
+
+        self._batches.append((timestamp, cmat, hist))
+        self.cmat += cmat
+        self.hist += hist
+        self._expire(timestamp)
+
+    def count(self):
+        return int(self.cmat.sum())
+
+    # The chance that a positive scores above a negative (ties
+    # counting half), or NaN if the window lacks either class
+    def auc(self):
+        negatives, positives = self.hist
+        n_neg, n_pos = negatives.sum(), positives.sum()
+        if not n_neg or not n_pos:
+            return float('nan')
+        below = np.cumsum(negatives) - negatives
+        return float((positives * (below + 0.5 * negatives)).sum()) / (n_pos * n_neg)
@@ -0,0 +1,198 @@
+#######################################################
+# Pipelined live scoring
+#
+# The live feed runs as three stages, each in its own
+# thread: fetch (request + preprocessing), score and
+# publish (metrics + plots), connected by bounded
+# queues. A slow stage blocks the one before it rather
+# than piling up work, and scheduler ticks that arrive
+# while a tick is still waiting to be fetched are
+# coalesced into it, so the scheduler never blocks.
+#######################################################
+
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LATENCY_PATH = "static/pipeline_latency.json"
+
+STAGES = ['fetch', 'score', 'publish']
+
+_STOP = object()
+
+
+# Counts of latencies in fixed, roughly logarithmic buckets,
+# from 1 ms to 60 s
+class LatencyHistogram(object):
+    BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+              1.0, 2.0, 5.0, 10.0, 20.0, 60.0]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    # The upper bound of the bucket holding the q-th quantile
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.BOUNDS + [self.max], self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': [[bound, count] for bound, count
+                            in zip(self.BOUNDS + ['inf'], self.counts)]}
+
+
+# fetch(timestamp) returns the data of one tick, or None if there
+# is nothing to score; score(timestamp, data) and publish(timestamp,
+# result) consume it. score may return None too if it finds nothing
+# to publish. A stage that raises drops that tick. With a
+# latency_path, the latency summary is written there after every
+# published tick.
+class LivePipeline(object):
+    def __init__(self, fetch, score, publish, queue_size=1, latency_path=None):
+        self.functions = {'fetch': fetch, 'score': score, 'publish': publish}
+        self.latency_path = latency_path
+        self.histograms = dict((name, LatencyHistogram()) for name in STAGES + ['total'])
+        self.counters = {'ticks': 0, 'coalesced': 0, 'empty': 0, 'errors': 0, 'published': 0}
+
+        self._queues = {'score': queue.Queue(queue_size), 'publish': queue.Queue(queue_size)}
+        self._tick = threading.Event()
+        self._pending = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # Requests a tick. Returns False if it was coalesced into a
+    # tick that has not been fetched yet.
+    def tick(self, timestamp=None):
+        with self._lock:
+            self.counters['ticks'] += 1
+            if self._pending is not None:
+                self.counters['coalesced'] += 1
+                return False
+            if timestamp is None:
+                timestamp = datetime.now()
+            self._pending = (timestamp, time.time())
+            self._tick.set()
+            return True
+
+    def start(self):
+        targets = [self._fetch_loop,
+                   lambda: self._stage_loop('score', 'publish'),
+                   lambda: self._stage_loop('publish', None)]
+        self._threads = [threading.Thread(target=target) for target in targets]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    # Stops once the ticks already requested have gone through
+    def stop(self, timeout=None):
+        with self._lock:
+            self._stopping = True
+            self._tick.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, name, *args):
+        start = time.time()
+        try:
+            return True, self.functions[name](*args)
+        except Exception as e:
+            print("Error in the", name, "stage:", e)
+            self._count('errors')
+            return False, None
+        finally:
+            self.histograms[name].observe(time.time() - start)
+
+    def _fetch_loop(self):
+        while True:
+            self._tick.wait()
+            with self._lock:
+                pending, self._pending = self._pending, None
+                if not self._stopping:
+                    self._tick.clear()
+
+            if pending is None:
+                break
+
+            timestamp, start = pending
+            ok, data = self._run('fetch', timestamp)
+            if ok and data is None:
+                print("No new data at", timestamp)
+                self._count('empty')
+            elif ok:
+                # Blocks while the scorer is busy with the previous tick
+                self._queues['score'].put((timestamp, start, data))
+
+        self._queues['score'].put(_STOP)
+
+    def _stage_loop(self, name, next_name):
+        while True:
+            item = self._queues[name].get()
+            if item is _STOP:
+                if next_name is not None:
+                    self._queues[next_name].put(_STOP)
+                return
+
+            timestamp, start, data = item
+            ok, result = self._run(name, timestamp, data)
+            if not ok:
+                continue
+
+            if next_name is not None and result is None:
+                print("Nothing to", next_name, "at", timestamp)
+                self._count('empty')
+            elif next_name is not None:
+                self._queues[next_name].put((timestamp, start, result))
+            else:
+                self.histograms['total'].observe(time.time() - start)
+                self._count('published')
+                if self.latency_path is not None:
+                    self.export(self.latency_path)
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {'counters': counters,
+                'latency': dict((name, hist.summary())
+                                for name, hist in self.histograms.items())}
+
+    def export(self, path=LATENCY_PATH):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fout:
+            json.dump(self.summary(), fout, indent=1, sort_keys=True)
+        os.rename(tmp, path)
@@ -0,0 +1,138 @@
+#######################################################
+# Append-only store of the live scoring metrics
+#
+# Every tick appends one row to static/running_data.csv
+# without reading the file, and the store keeps the
+# last rows parsed in memory. A reader (e.g. the web
+# app) picks up new rows by reading only the bytes
+# appended since its last refresh, so neither side's
+# cost grows with the length of the file.
+#######################################################
+
+import csv
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+METRICS_PATH = "static/running_data.csv"
+
+# The columns of running_data.csv, in file order
+COLUMNS = ['Accuracy', 'False neg.', 'False pos.', 'ROC-AUC', 'Time', 'True neg.', 'True pos.']
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+# str(datetime) leaves out the microseconds when they are zero
+def _parse_time(time_str):
+    try:
+        return datetime.strptime(time_str, TIME_FORMAT)
+    except ValueError:
+        return datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_row(header, values):
+    row = {}
+    for name, value in zip(header, values):
+        if name == 'Time':
+            row[name] = _parse_time(value)
+        else:
+            row[name] = float(value) if value not in ('', 'NA', 'nan') else float('nan')
+    return row
+
+
+# The position in the open (binary) file fin where its last n
+# lines after start begin, reading blocks backwards from end
+def _tail_start(fin, n, start, end, block_size=2 ** 16):
+    position = end
+    data = b''
+    while position > start and data.count(b'\n') <= n:
+        step = min(block_size, position - start)
+        position -= step
+        fin.seek(position)
+        data = fin.read(step) + data
+    if position <= start:
+        return start
+    return end - len(b'\n'.join(data.split(b'\n')[-n - 1:]))
+
+
+class MetricsStore(object):
+    def __init__(self, path=METRICS_PATH, tail_size=2000):
+        self.path = path
+        self.tail = deque(maxlen=tail_size)
+        self.header = None
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    # Reads the rows appended to the file since the last refresh
+    # (only the last tail_size of them on the first read). Returns
+    # the number of new rows.
+    def refresh(self):
+        with self._lock:
+            if not os.path.isfile(self.path):
+                return 0
+
+            size = os.path.getsize(self.path)
+            if size < self._offset:
+                # The file was replaced; start over
+                self.tail.clear()
+                self.header, self._offset = None, 0
+            if size == self._offset:
+                return 0
+
+            with open(self.path, 'rb') as fin:
+                begin = self._offset
+                if self.header is None:
+                    self.header = next(csv.reader([fin.readline().decode('utf-8')]))
+                    # Only the rows that fit in the tail are parsed
+                    begin = _tail_start(fin, self.tail.maxlen, fin.tell(), size)
+                fin.seek(begin)
+                data = fin.read(size - begin)
+
+            # A partly written last line is left for next time
+            complete = data.rfind(b'\n') + 1
+            self._offset = begin + complete
+            lines = [line.decode('utf-8') for line in data[:complete].split(b'\n') if line.strip()]
+
+            for values in csv.reader(lines):
+                self.tail.append(_parse_row(self.header, values))
+            return len(lines)
+
+    # Appends one row of metrics (a dict with the COLUMNS, Time a
+    # datetime), writing the header first if the file is missing
+    # or empty
+    def append(self, row):
+        with self._lock:
+            new_file = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+            if self.header is None and not new_file:
+                # Written by someone else since the last refresh
+                with open(self.path) as fin:
+                    self.header = next(csv.reader([fin.readline()]))
+            with open(self.path, 'a') as fout:
+                writer = csv.writer(fout, lineterminator='\n')
+                if new_file:
+                    writer.writerow(COLUMNS)
+                    self.header = list(COLUMNS)
+                writer.writerow([row[name] for name in self.header])
+            self._offset = os.path.getsize(self.path)
+
+            parsed = dict(row)
+            parsed['Time'] = pd.Timestamp(row['Time']).to_pydatetime()
+            self.tail.append(parsed)
+
+    # The last n rows (all of the tail by default) as a data frame
+    def frame(self, n=None):
+        rows = list(self.tail)
+        if n is not None:
+            rows = rows[-n:]
+        return pd.DataFrame(rows, columns=self.header or COLUMNS)
+
+    # The tail rolled up into buckets of the given width (a pandas
+    # frequency such as '10min'), averaging the metrics
+    def downsample(self, bucket, n=None):
+        data = self.frame(n).set_index('Time')
+        data = data.resample(bucket).mean().dropna(how='all')
+        return data.reset_index()
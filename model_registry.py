@@ -0,0 +1,131 @@
+#######################################################
+# Registry of the loaded models
+#
+# Each model is loaded once and kept in memory. A
+# model is only reloaded when its file changes: the
+# mtime is checked on every get, and the file is only
+# re-hashed (and reloaded if the hash differs) when the
+# mtime moves.
+#######################################################
+
+import hashlib
+import os
+import threading
+
+try:
+    from sklearn.externals import joblib
+except ImportError:
+    import joblib
+
+from flat_forest import FlatForest, flat_path
+from preproc_rf import CategoricalEncoder, ENCODER_PATH
+
+MODEL_PATH = 'static/model_pkl/rf_model_april_27_2016.pkl'
+
+# The engine that scores the live batches: 'sklearn' (the pickle)
+# or 'flat' (the flat forest saved next to it). The flat forest is
+# only faster for small batches, so batches of more than
+# FLAT_MAX_ROWS rows are scored with the pickle either way.
+ENGINE = os.environ.get('RF_ENGINE', 'sklearn')
+FLAT_MAX_ROWS = 200
+
+
+# The files of path: path itself, or the files in it if it is a
+# directory (a flat forest)
+def _files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+
+
+def _mtime(path):
+    return max([os.path.getmtime(path)] + [os.path.getmtime(f) for f in _files(path)])
+
+
+def _file_hash(path, block_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    for filename in _files(path):
+        sha1.update(os.path.basename(filename).encode('utf-8'))
+        with open(filename, 'rb') as fin:
+            for block in iter(lambda: fin.read(block_size), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+# Pickled forests are read into memory: sklearn copies the tree
+# arrays into buffers of its own when it unpickles them, so there
+# is nothing to map. A directory is loaded as a flat_forest.FlatForest
+# with its .npy files memory-mapped (read-only by default), so the
+# pages are shared by every process that loads the same forest, and
+# a .json file as a preproc_rf.CategoricalEncoder.
+class ModelRegistry(object):
+    def __init__(self, mmap_mode='r'):
+        self.mmap_mode = mmap_mode
+        self.n_loads = 0
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _load(self, path):
+        self.n_loads += 1
+        if os.path.isdir(path):
+            return FlatForest.load(path, mmap_mode=self.mmap_mode)
+        if path.endswith('.json'):
+            return CategoricalEncoder.load(path)
+        return joblib.load(path)
+
+    # The model saved at path, reloaded if the file has changed.
+    # While a flat forest is being replaced (see FlatForest.save)
+    # its directory is briefly missing, and the loaded one is kept.
+    def get(self, path=MODEL_PATH):
+        path = os.path.abspath(path)
+
+        with self._lock:
+            entry = self._models.get(path)
+            try:
+                return self._get(path, entry)
+            except (IOError, OSError):
+                if entry is None:
+                    raise
+                return entry['model']
+
+    def _get(self, path, entry):
+        mtime = _mtime(path)
+        if entry is not None and entry['mtime'] == mtime:
+            return entry['model']
+
+        digest = _file_hash(path)
+        if entry is not None and entry['hash'] == digest:
+            entry['mtime'] = mtime
+            return entry['model']
+
+        model = self._load(path)
+        self._models[path] = {'model': model, 'mtime': mtime, 'hash': digest}
+        return model
+
+    # The hash of the loaded version of the model at path
+    def version(self, path=MODEL_PATH):
+        entry = self._models.get(os.path.abspath(path))
+        return entry['hash'] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+# The registry shared by the scorer
+_registry = ModelRegistry()
+
+
+# The model to score a batch of n_rows rows with: the flat forest
+# of the pickle at path if ENGINE is 'flat', the batch is small
+# enough and the flat forest exists, and the pickle otherwise
+def get_model(path=MODEL_PATH, n_rows=None):
+    if ENGINE == 'flat' and (n_rows is None or n_rows <= FLAT_MAX_ROWS):
+        if os.path.isdir(flat_path(path)):
+            return _registry.get(flat_path(path))
+    return _registry.get(path)
+
+
+# The encoder of the model, reloaded when retraining extends it
+def get_encoder(path=ENCODER_PATH):
+    return _registry.get(path)
@@ -5,6 +5,8 @@ from sklearn.metrics import confusion_matrix, roc_auc_score
 from sklearn.externals import joblib
 import pprint as pp
 
+from flat_forest import FlatForest
+
 #######################################################
 # Read in the data
 #######################################################
@@ -81,3 +83,6 @@ print(score_card)
 #######################################################
 
 joblib.dump(clf, '../../static/model_pkl/rf_model_april_27_2016.pkl',protocol=2)
+
+# The flattened trees, for scoring without sklearn (see flat_forest.py)
+FlatForest.from_sklearn(clf).save('../../static/model_pkl/rf_model_april_27_2016.flat')
@@ -1,8 +1,18 @@
-import pandas as pd
+import hashlib
+import json
+from optparse import OptionParser
 import numpy as np
-from sklearn import preprocessing
-from sklearn.feature_selection import VarianceThreshold
-from dateutil.parser import parse as parse
+import pandas as pd
+
+from listing_store import ListingStore
+
+# The columns of the listing store that the model uses, in the
+# order of the training data (endTime is kept for time splits)
+INPUT_COLUMNS = ['productId_type', 'productId_value', 'conditionDisplayName', 'conditionId',
+                 'endTime', 'country', 'listingType', 'buyItNowAvailable', 'bestOfferEnabled',
+                 'paymentMethod', 'expeditedShipping', 'shippingType', 'isShippingFree',
+                 'returnsAccepted', 'feedbackRatingStar', 'feedbackScore',
+                 'positiveFeedbackPercent', 'topRatedSeller', 'value', 'sellingState']
 
 
 #######################################################
@@ -36,37 +46,101 @@ from dateutil.parser import parse as parse
 # value
 
 
-def encode(data):
-    # These are the encoded features
-    features_to_encode = ('productId_type', 'productId_value', 'conditionDisplayName', 'conditionId',
-                          'categoryId', 'categoryName', 'country', 'listingType', 'buyItNowAvailable',
-                          'bestOfferEnabled', 'topRatedListing', 'gift', 'paymentMethod', 'expeditedShipping',
-                          'expeditedShipping', 'shippingType', 'isShippingFree', 'returnsAccepted', 'sellingState',
-                          'feedbackRatingStar', 'topRatedSeller')
-
-    # Convert them all to string for sorting
-    for feat in features_to_encode:
-        data[feat] = [str(i) for i in data[feat]]
-
-    # This is the label encoder
-    le = preprocessing.LabelEncoder()
+# These are the encoded features
+FEATURES_TO_ENCODE = ('productId_type', 'productId_value', 'conditionDisplayName', 'conditionId',
+                      'categoryId', 'categoryName', 'country', 'listingType', 'buyItNowAvailable',
+                      'bestOfferEnabled', 'topRatedListing', 'gift', 'paymentMethod', 'expeditedShipping',
+                      'shippingType', 'isShippingFree', 'returnsAccepted', 'sellingState',
+                      'feedbackRatingStar', 'topRatedSeller')
+
+# The encoder fitted on the training data, used by the live scorer
+ENCODER_PATH = 'static/model_pkl/encoder.json'
+
+
+# The values as strings, the way they were cast for the
+# LabelEncoder; missing values ('NA' placeholders from the
+# API, NULL/NaN from the store) all become 'nan'
+def _as_str(column):
+    column = column.astype(object)
+    return column.where(column.notnull() & (column != 'NA'), 'nan').astype(str)
+
+
+# Maps each categorical feature to the codes it had in the training
+# data. The vocabulary of each feature is its sorted string values,
+# so the codes are the ones LabelEncoder gave, followed by any values
+# added later by extend; values that were not seen fall in the
+# unknown bucket, -1.
+class CategoricalEncoder(object):
+    UNKNOWN = -1
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else {}
+
+    def fit(self, data, features=FEATURES_TO_ENCODE):
+        # Features that were not read in are skipped
+        self.vocabulary = dict((feat, sorted(_as_str(data[feat]).unique()))
+                               for feat in features if feat in data)
+        return self
+
+    # Adds the values in data to the vocabulary, so that the encoder
+    # can be fitted one chunk at a time
+    def partial_fit(self, data, features=FEATURES_TO_ENCODE):
+        for feat in features:
+            if feat in data:
+                values = set(self.vocabulary.get(feat, [])) | set(_as_str(data[feat]).unique())
+                self.vocabulary[feat] = sorted(values)
+        return self
+
+    # Adds the values in data that are not in the vocabulary yet
+    # after the known ones, so the codes the model was trained with
+    # stay the same (unlike partial_fit, which keeps them sorted).
+    # Returns the number of values added.
+    def extend(self, data, features=FEATURES_TO_ENCODE):
+        n_added = 0
+        for feat in features:
+            if feat in data:
+                values = self.vocabulary.setdefault(feat, [])
+                known = set(values)
+                new = sorted(set(_as_str(data[feat]).unique()) - known)
+                values.extend(new)
+                n_added += len(new)
+        return n_added
+
+    def transform(self, data):
+        for feat, values in self.vocabulary.items():
+            if feat in data:
+                data[feat] = pd.Categorical(_as_str(data[feat]), categories=values).codes
+        return data
+
+    def fit_transform(self, data, features=FEATURES_TO_ENCODE):
+        return self.fit(data, features).transform(data)
+
+    def save(self, path=ENCODER_PATH):
+        with open(path, 'w') as fout:
+            json.dump(self.vocabulary, fout, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, path=ENCODER_PATH):
+        with open(path) as fin:
+            return cls(json.load(fin))
+
+
+# Encodes the categorical features with a fitted encoder, or fits
+# one on data itself if none is given (only consistent within data!)
+def encode(data, encoder=None):
+    if encoder is None:
+        encoder = CategoricalEncoder().fit(data)
 
     # Encode all the features (This only makes sense for tree-based model!)
-    for feat in features_to_encode:
-        le.fit(data[feat])
-        data[feat] = le.transform(data[feat])
-
-    return(data)
+    return(encoder.transform(data))
 
 #######################################################
 # Set value to zero for auction items
 #######################################################
 
-def set_auction_value_zero(record):
-    if record['listingType'] == 'Auction':
-        return 0
-    else:
-        return record['value']
+def set_auction_value_zero(data):
+    data['value'] = data['value'].where(data['listingType'] != 'Auction', 0)
+    return(data)
 
 #######################################################
 # Convert datetime fields categorical variables
@@ -78,20 +152,28 @@ def set_auction_value_zero(record):
 # Monthday (0-[28-31])
 # Month (0-11)
 
-# First, get the datetime
-
-def times_to_categorical(data):
-    # Start times:
-    data['startHour'] = [parse(x).hour for x in data.startTime]
-    data['startWeekday'] = [parse(x).weekday() for x in data.startTime]
-    data['startMonthday'] = [parse(x).day for x in data.startTime]
-    data['startMonth'] = [parse(x).month for x in data.startTime]
-
-    # End times:
-    data['endHour'] = [parse(x).hour for x in data.endTime]
-    data['endWeekday'] = [parse(x).weekday() for x in data.endTime]
-    data['endMonthday'] = [parse(x).day for x in data.endTime]
-    data['endMonth'] = [parse(x).month for x in data.endTime]
+# Feature name: (time column, datetime accessor)
+TIME_FEATURES = {'startHour': ('startTime', 'hour'),
+                 'startWeekday': ('startTime', 'weekday'),
+                 'startMonthday': ('startTime', 'day'),
+                 'startMonth': ('startTime', 'month'),
+                 'endHour': ('endTime', 'hour'),
+                 'endWeekday': ('endTime', 'weekday'),
+                 'endMonthday': ('endTime', 'day'),
+                 'endMonth': ('endTime', 'month')}
+
+# The time features that delete_unwanted keeps
+KEPT_TIME_FEATURES = ['endHour', 'endWeekday']
+
+# Each time column is parsed once, in bulk, and only the
+# requested features are derived from it.
+def times_to_categorical(data, features=KEPT_TIME_FEATURES):
+    parsed = {}
+    for feat in features:
+        col, field = TIME_FEATURES[feat]
+        if col not in parsed:
+            parsed[col] = pd.to_datetime(data[col], utc=True).dt
+        data[feat] = getattr(parsed[col], field)
 
     return(data)
 
@@ -105,33 +187,72 @@ def delete_unwanted(data):
                'topRatedListing','gift', 'categoryName',
                'categoryId','startHour','startMonth',
                'endMonth','startMonthday','endMonthday','startWeekday'],
-              axis=1, inplace=True)
+              axis=1, inplace=True, errors='ignore')
     return(data)
 
 #######################################################
-# Remove columns with zero variance
+# Remove constant and duplicate columns
 #######################################################
 
+# The values of a column in a form that does not depend on its
+# dtype: numbers and flags as float64 (missing values as NaN), so
+# an int8 and a float32 copy of [0, 1, 0, 1] come out the same,
+# and anything else as objects with missing values as None
+def _canonical_values(column):
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return column.to_numpy(dtype='float64', na_value=np.nan)
+    return column.astype(object).where(column.notnull(), None).values
+
+
+def _same_values(a, b):
+    if a.dtype == np.float64 and b.dtype == np.float64:
+        return np.array_equal(a, b, equal_nan=True)
+    return np.array_equal(a, b)
+
+
+# Finds the redundant columns in one pass: each column is hashed
+# once (row hashes of its canonical values, then a digest of
+# those), constant columns are the ones whose rows all hash alike,
+# and a column only has to be compared with the earlier columns in
+# its digest's bucket.
+# Returns (constant columns, columns duplicating an earlier one).
+def find_redundant_cols(data):
+    constant, duplicate = [], []
+    buckets = {}
+    for col in data.columns:
+        values = _canonical_values(data[col])
+        row_hashes = pd.util.hash_array(values)
+
+        if (row_hashes == row_hashes[:1]).all() and data[col].nunique(dropna=False) <= 1:
+            constant.append(col)
+            continue
+
+        bucket = buckets.setdefault(hashlib.sha1(row_hashes.tobytes()).hexdigest(), [])
+        if any(_same_values(_canonical_values(data[other]), values) for other in bucket):
+            duplicate.append(col)
+        else:
+            bucket.append(col)
+
+    return constant, duplicate
+
+
 def remove_const(data):
-    selector = VarianceThreshold()
-    selector.fit_transform(data)
+    constant, duplicate = find_redundant_cols(data)
+    data.drop(constant, axis=1, inplace=True)
 
     return data
 
-#######################################################
-# Remove duplicate columns
-#######################################################
 
 def remove_duplicate_cols(data):
-    colsToRemove = []
-    columns = data.columns
-    for i in range(len(columns)-1):
-        v = data[columns[i]].values
-        for j in range(i+1,len(columns)):
-            if np.array_equal(v,data[columns[j]].values):
-                colsToRemove.append(columns[j])
+    constant, duplicate = find_redundant_cols(data)
+    data.drop(duplicate, axis=1, inplace=True)
 
-    data.drop(colsToRemove, axis=1, inplace=True)
+    return data
+
+
+def remove_redundant_cols(data):
+    constant, duplicate = find_redundant_cols(data)
+    data.drop(constant + duplicate, axis=1, inplace=True)
 
     return data
 
@@ -139,9 +260,9 @@ def remove_duplicate_cols(data):
 # Helper
 #######################################################
 
-def preproc_rf(data):
-    data['value'] = data.apply(set_auction_value_zero, axis=1)
-    data = encode(data)
+def preproc_rf(data, encoder=None):
+    data = set_auction_value_zero(data)
+    data = encode(data, encoder)
     data = times_to_categorical(data)
     data = delete_unwanted(data)
 
@@ -153,22 +274,91 @@ def preproc_rf(data):
 # Main
 #######################################################
 
+# The training data, with and without the listings' end times
+RF_ENDTIME_PATH = "Data/ebay_data_rf_endTime.csv"
+RF_PATH = "Data/ebay_data_rf.csv"
+
+
+# Preprocesses the listings one chunk at a time with a fitted
+# encoder, appending each chunk to both training files, so memory
+# use is bounded by chunksize rather than by the history.
+# Returns the number of rows written.
+def preproc_rf_chunked(chunks, encoder, endtime_path=RF_ENDTIME_PATH, path=RF_PATH):
+    n_rows = 0
+    for data in chunks:
+        data = preproc_rf(data, encoder)
+
+        mode, header = ('w', True) if n_rows == 0 else ('a', False)
+        data.to_csv(endtime_path, mode=mode, header=header, na_rep="NA", index=False)
+        data.drop(['endTime'], axis=1, inplace=True)
+        data.to_csv(path, mode=mode, header=header, na_rep="NA", index=False)
+
+        n_rows += len(data)
+        print("Written", n_rows, "rows")
+
+    return n_rows
+
+
 if __name__ == '__main__':
-    print("Reading from csv...")
-    data = pd.read_csv('Data/ebay_data.csv', index_col=False)
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--start",
+                      dest="start", default=None,
+                      help="Only use listings that ended at or after this GMT time.")
+    parser.add_option("--end",
+                      dest="end", default=None,
+                      help="Only use listings that ended at or before this GMT time.")
+    parser.add_option("-c", "--chunksize",
+                      dest="chunksize", type="int", default=None,
+                      help="Preprocess the listings this many rows at a time "
+                           "instead of all at once.")
+    parser.add_option("-e", "--encoder",
+                      dest="encoder", default=None,
+                      help="Use this fitted encoder (json) instead of fitting "
+                           "one and saving it to %s." % ENCODER_PATH)
+    (opts, args) = parser.parse_args()
+
+    store = ListingStore()
+
+    if opts.encoder:
+        print("Loading the encoder from", opts.encoder)
+        encoder = CategoricalEncoder.load(opts.encoder)
+    elif opts.chunksize:
+        print("Fitting the encoder...")
+        features = [feat for feat in FEATURES_TO_ENCODE if feat in INPUT_COLUMNS]
+        encoder = CategoricalEncoder()
+        for chunk in store.iter_read(features, start=opts.start, end=opts.end,
+                                     chunksize=opts.chunksize):
+            encoder.partial_fit(chunk)
+        encoder.save()
+
+    if opts.chunksize:
+        print("Preprocessing", opts.chunksize, "rows at a time...")
+        chunks = store.iter_read(INPUT_COLUMNS, start=opts.start, end=opts.end,
+                                 chunksize=opts.chunksize)
+        n_rows = preproc_rf_chunked(chunks, encoder)
+
+        print("Final number of rows:", n_rows)
 
-    print("Preprocessing...")
-    data = preproc_rf(data)
+    else:
+        print("Reading from the listing store...")
+        data = store.read(INPUT_COLUMNS, start=opts.start, end=opts.end)
 
-    print("Final shape:", data.shape)
+        if not opts.encoder:
+            print("Fitting the encoder...")
+            encoder = CategoricalEncoder().fit(data)
+            encoder.save()
 
-    print("Writing to csv...")
+        print("Preprocessing...")
+        data = preproc_rf(data, encoder)
 
-    data.to_csv("Data/ebay_data_rf_endTime.csv", na_rep="NA", index=False)
+        print("Final shape:", data.shape)
 
-    data.drop(['endTime'], axis=1, inplace=True)
+        print("Writing to csv...")
 
-    data.to_csv("Data/ebay_data_rf.csv", na_rep="NA", index=False)
+        data.to_csv(RF_ENDTIME_PATH, na_rep="NA", index=False)
 
-    print("Done.")
+        data.drop(['endTime'], axis=1, inplace=True)
 
+        data.to_csv(RF_PATH, na_rep="NA", index=False)
+
+    print("Done.")
@@ -0,0 +1,122 @@
+#######################################################
+# On-disk cache of raw Finding API responses
+#
+# Each page is stored gzipped under a hash of the
+# normalized request and page number, so re-running a
+# harvest with the same request (e.g. with ebay.py
+# --end-time pinned) replays it without the network.
+#######################################################
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = "Data/response_cache"
+
+
+# The request without its pagination, with the item filters
+# in a fixed order, plus the page number
+def _normalize(api_request, page_number):
+    request = dict(api_request)
+    request.pop('paginationInput', None)
+    if 'itemFilter' in request:
+        request['itemFilter'] = sorted(request['itemFilter'], key=lambda x: x['name'])
+    return {'request': request, 'page': page_number}
+
+
+def _mtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return 0
+
+
+def request_key(api_request, page_number=1):
+    normalized = json.dumps(_normalize(api_request, page_number), sort_keys=True)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+# ttl is in seconds and max_bytes is the total size of the cache;
+# None disables expiry or eviction. Once the cache is over
+# max_bytes, the least recently written pages are evicted.
+class ResponseCache(object):
+    def __init__(self, path=CACHE_DIR, ttl=None, max_bytes=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.n_bytes = sum(os.path.getsize(f) for f in self._files())
+
+    def _files(self):
+        return [os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith('.json.gz')]
+
+    def _file(self, api_request, page_number):
+        return os.path.join(self.path, request_key(api_request, page_number) + '.json.gz')
+
+    def _remove(self, filename):
+        try:
+            size = os.path.getsize(filename)
+            os.remove(filename)
+        except OSError:
+            return
+        with self._lock:
+            self.n_bytes -= size
+
+    # Returns the cached response, or None if there is none
+    # or it has expired
+    def get(self, api_request, page_number=1):
+        filename = self._file(api_request, page_number)
+
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(filename) > self.ttl:
+                self._remove(filename)
+                raise IOError("expired")
+            with gzip.open(filename, 'rb') as fin:
+                response = json.loads(fin.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, api_request, page_number, response):
+        filename = self._file(api_request, page_number)
+        tmp = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+
+        with gzip.open(tmp, 'wb') as fout:
+            fout.write(json.dumps(response, default=str).encode('utf-8'))
+
+        if os.path.isfile(filename):
+            self._remove(filename)
+        os.rename(tmp, filename)
+
+        with self._lock:
+            self.n_bytes += os.path.getsize(filename)
+
+        if self.max_bytes is not None and self.n_bytes > self.max_bytes:
+            self.evict()
+
+    # Removes the oldest pages until the cache fits in max_bytes
+    def evict(self):
+        with self._evict_lock:
+            for filename in sorted(self._files(), key=_mtime):
+                if self.n_bytes <= self.max_bytes:
+                    break
+                self._remove(filename)
+
+    def clear(self):
+        for filename in self._files():
+            self._remove(filename)
@@ -0,0 +1,259 @@
+#######################################################
+# Incremental retraining of the random forest
+#
+# When the live metrics (see metrics_store.py) drift
+# down, the listings that ended since the last harvest
+# are added to the store, and trees fitted on the
+# newest of them are added to the production forest
+# with warm_start, while as many of the oldest trees
+# are retired. Only the new window is preprocessed and
+# fitted, so a retrain costs the same however long the
+# history is. The encoder's vocabulary is extended with
+# the new products and categories, and the encoder and
+# pickle are replaced atomically; the scorer's model
+# registry picks both up by itself, e.g.
+#
+#   python retrain_rf.py --hours 24 --trees 50
+#######################################################
+
+from __future__ import print_function
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+import numpy as np
+
+try:
+    from sklearn.externals import joblib
+except ImportError:
+    import joblib
+
+import ebay
+from flat_forest import FlatForest, flat_path
+from listing_store import ListingStore
+from metrics_store import MetricsStore
+from model_registry import MODEL_PATH
+from preproc_rf import (preproc_rf, CategoricalEncoder, INPUT_COLUMNS, FEATURES_TO_ENCODE,
+                        ENCODER_PATH)
+import scoring
+
+# The window of listings the new trees are fitted on
+RETRAIN_WINDOW = timedelta(hours=24)
+
+# The number of trees added (and retired) per retrain
+N_NEW_TREES = 50
+
+# Minimum time between two retrains
+COOLDOWN = timedelta(hours=6)
+
+
+#######################################################
+# Drift detection
+#######################################################
+
+# Compares the mean metrics of the recent window with those of the
+# reference window before it. Returns (drifted, details): drifted is
+# True if the ROC AUC or the accuracy dropped by at least min_drop
+# and both windows have at least min_points ticks.
+def detect_drift(metrics, recent=timedelta(hours=1), reference=timedelta(hours=24),
+                 min_drop=0.05, min_points=30):
+    if not len(metrics):
+        return False, {}
+
+    last = metrics.Time.max()
+    is_recent = metrics.Time > last - recent
+    is_reference = (metrics.Time > last - recent - reference) & ~is_recent
+
+    details = {'recent_points': int(is_recent.sum()),
+               'reference_points': int(is_reference.sum())}
+    if min(details['recent_points'], details['reference_points']) < min_points:
+        return False, details
+
+    drifted = False
+    for col in ['ROC-AUC', 'Accuracy']:
+        recent_mean = np.nanmean(metrics.loc[is_recent, col].values)
+        reference_mean = np.nanmean(metrics.loc[is_reference, col].values)
+        details[col] = (reference_mean, recent_mean)
+        drifted = drifted or bool(reference_mean - recent_mean >= min_drop)
+
+    return drifted, details
+
+
+#######################################################
+# Retraining
+#######################################################
+
+def _time_str(time):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+# Adds the listings that ended since the store's high-water mark to
+# the store, as `ebay.py -i` does, but never reaching back further
+# than the window (an older gap is left to a full harvest). Returns
+# the number of listings fetched.
+def harvest(store, window=RETRAIN_WINDOW, opts=None):
+    opts = opts if opts is not None else ebay.init_options(['--quiet'])[0]
+    api_request = ebay.get_api_dict()
+    start = datetime.utcnow() - window
+
+    mark = store.high_water_mark()
+    if mark is not None and ebay._parse_time_str(mark['endTime']) > start:
+        data = ebay.get_new(opts, api_request, mark)
+    else:
+        data = ebay.get_all_after(opts, api_request, _time_str(start))
+
+    if len(data):
+        store.upsert(ebay.preproc(data))
+    return len(data)
+
+
+# The features whose vocabulary grows with new listings: all the
+# encoded ones but the target
+EXTENDED_FEATURES = [feat for feat in FEATURES_TO_ENCODE if feat != 'sellingState']
+
+
+# The inputs and target of the listings that ended in the last
+# window. The encoder's vocabulary is first extended with the values
+# new in the window, which keeps the codes the model was trained
+# with. Listings with an unknown target are left out.
+def window_data(window=RETRAIN_WINDOW, store=None, encoder=None):
+    store = store if store is not None else ListingStore()
+    encoder = encoder if encoder is not None else CategoricalEncoder.load()
+
+    data = store.read(INPUT_COLUMNS, start=_time_str(datetime.utcnow() - window))
+    n_added = encoder.extend(data, EXTENDED_FEATURES)
+    if n_added:
+        print("Added", n_added, "new values to the encoder")
+    data = preproc_rf(data, encoder)
+
+    data = data[data.sellingState != CategoricalEncoder.UNKNOWN]
+    y = data.pop('sellingState')
+    data = data.drop(['endTime'], axis=1)
+    return scoring.as_features(data), y
+
+
+# Adds n_new trees fitted on (X, y) to clf and retires its n_retire
+# oldest trees. The new data must have all of clf's classes.
+def grow_and_retire(clf, X, y, n_new=N_NEW_TREES, n_retire=N_NEW_TREES):
+    if set(np.unique(y)) != set(clf.classes_):
+        raise ValueError("The new listings do not have all the classes %s"
+                         % list(clf.classes_))
+
+    n_trees = len(clf.estimators_)
+    clf.set_params(warm_start=True, n_estimators=n_trees + n_new)
+    clf.fit(X, y)
+
+    n_retire = min(n_retire, n_trees)
+    clf.estimators_ = clf.estimators_[n_retire:]
+    clf.set_params(n_estimators=len(clf.estimators_), warm_start=False)
+    return clf
+
+
+# Writes path through a temporary file, so that the scorer never
+# loads a half-written model
+def _replace(path, write):
+    tmp = path + '.tmp'
+    write(tmp)
+    os.rename(tmp, path)
+
+
+# Harvests the newest listings, retrains the model at model_path on
+# the last window of them and replaces it (and its flat forest and
+# the encoder at encoder_path) in place. The encoder is replaced
+# first: it only adds codes after the old ones, which the old forest
+# sees as values it was not trained on until the new one is in
+# place. Returns the number of listings the new trees were
+# fitted on.
+def retrain(model_path=MODEL_PATH, window=RETRAIN_WINDOW, n_new=N_NEW_TREES,
+            n_retire=N_NEW_TREES, encoder_path=ENCODER_PATH, opts=None):
+    clf = joblib.load(model_path)
+    encoder = CategoricalEncoder.load(encoder_path)
+
+    store = ListingStore()
+    try:
+        print("Harvested", harvest(store, window, opts), "new listings")
+        X, y = window_data(window, store, encoder)
+    finally:
+        store.close()
+
+    print("Fitting", n_new, "trees on", len(y), "listings from the last", window)
+    start = time.time()
+    clf = grow_and_retire(clf, X, y, n_new, n_retire)
+    print("Fitted in %.1f s; the forest has %d trees" % (time.time() - start,
+                                                          len(clf.estimators_)))
+
+    _replace(encoder_path, encoder.save)
+    _replace(model_path, lambda tmp: joblib.dump(clf, tmp, protocol=2))
+    if os.path.isdir(flat_path(model_path)):
+        FlatForest.from_sklearn(clf).save(flat_path(model_path))
+
+    return len(y)
+
+
+# Checks the running metrics for drift and retrains in a background
+# thread when they have drifted, at most once per cooldown
+class Retrainer(object):
+    def __init__(self, cooldown=COOLDOWN, **retrain_kwargs):
+        self.cooldown = cooldown
+        self.retrain_kwargs = retrain_kwargs
+        self.last_retrain = None
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def check(self, metrics):
+        now = datetime.now()
+        if self.running() or (self.last_retrain is not None
+                              and now - self.last_retrain < self.cooldown):
+            return False
+
+        drifted, details = detect_drift(metrics)
+        if not drifted:
+            return False
+
+        print("Metrics drifted, retraining:", details)
+        self.last_retrain = now
+        self._thread = threading.Thread(target=self._retrain)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def _retrain(self):
+        try:
+            retrain(**self.retrain_kwargs)
+        except Exception as e:
+            print("Retraining failed:", e)
+
+
+#######################################################
+# Main
+#######################################################
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-m", "--model",
+                      dest="model", default=MODEL_PATH,
+                      help="The pickled forest to retrain in place.")
+    parser.add_option("-e", "--encoder",
+                      dest="encoder", default=ENCODER_PATH,
+                      help="The encoder of the forest, extended in place.")
+    parser.add_option("--hours",
+                      dest="hours", type="float", default=RETRAIN_WINDOW.total_seconds() / 3600,
+                      help="Fit the new trees on the listings that ended in this many hours.")
+    parser.add_option("-t", "--trees",
+                      dest="trees", type="int", default=N_NEW_TREES,
+                      help="The number of trees to add and to retire.")
+    parser.add_option("-f", "--force",
+                      dest="force", action="store_true", default=False,
+                      help="Retrain even if the running metrics have not drifted.")
+    (opts, args) = parser.parse_args()
+
+    drifted, details = detect_drift(MetricsStore().frame())
+    print("Drift:", drifted, details)
+
+    if drifted or opts.force:
+        retrain(opts.model, timedelta(hours=opts.hours), opts.trees, opts.trees, opts.encoder)
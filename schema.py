@@ -0,0 +1,100 @@
+#######################################################
+# Column types of the listing data frames
+#
+# Left to itself pandas keeps every harvested column as
+# Python objects, with 'NA' strings mixed into numeric
+# fields. Repeated strings are stored as categoricals,
+# counts as nullable ints, flags as nullable booleans,
+# and every missing value as a real NaN/NA.
+#######################################################
+
+import pandas as pd
+
+# Placeholders for missing values: ebay._get_relevant_data writes
+# 'NA' and ebay._map_column writes 'NaN'
+MISSING = ['NA', 'NaN']
+
+# The listings of ebay.preproc and the listing store. Columns left
+# out (itemId, title, the times) are unique per row and stay strings.
+# These frames are written to the store, so the real-valued columns
+# stay float64: a float32 95.1 would be stored as 95.0999984741211.
+LISTING_DTYPES = {'productId_type': 'category',
+                  'productId_value': 'category',
+                  'conditionDisplayName': 'category',
+                  'conditionId': 'category',
+                  'categoryId': 'category',
+                  'categoryName': 'category',
+                  'postalCode': 'category',
+                  'country': 'category',
+                  'listingType': 'category',
+                  'bidCount': 'Int32',
+                  'buyItNowAvailable': 'boolean',
+                  'bestOfferEnabled': 'boolean',
+                  'gift': 'boolean',
+                  'paymentMethod': 'category',
+                  'expeditedShipping': 'boolean',
+                  'shippingType': 'category',
+                  'isShippingFree': 'boolean',
+                  'returnsAccepted': 'boolean',
+                  'topRatedListing': 'boolean',
+                  'feedbackRatingStar': 'category',
+                  'feedbackScore': 'Int32',
+                  'positiveFeedbackPercent': 'float64',
+                  'topRatedSeller': 'category',
+                  'value': 'float64',
+                  'sellingState': 'category'}
+
+# The encoded training data written by preproc_rf.py. The codes
+# are small ints (-1 for unknown values). The forest casts its
+# inputs to float32 anyway, so the numeric features are read as
+# float32, which also holds the feedback scores exactly (< 2**24).
+RF_DTYPES = {'productId_type': 'int16',
+             'productId_value': 'int16',
+             'conditionDisplayName': 'int16',
+             'conditionId': 'int16',
+             'country': 'int16',
+             'listingType': 'int16',
+             'buyItNowAvailable': 'int16',
+             'bestOfferEnabled': 'int16',
+             'paymentMethod': 'int16',
+             'expeditedShipping': 'int16',
+             'shippingType': 'int16',
+             'isShippingFree': 'int16',
+             'returnsAccepted': 'int16',
+             'feedbackRatingStar': 'int16',
+             'feedbackScore': 'float32',
+             'positiveFeedbackPercent': 'float32',
+             'topRatedSeller': 'int16',
+             'value': 'float32',
+             'sellingState': 'int16',
+             'endHour': 'int8',
+             'endWeekday': 'int8'}
+
+_NON_NUMERIC = ['category', 'boolean', 'object', 'str']
+
+
+# Converts the columns of data that appear in dtypes, with the
+# missing value placeholders replaced by NaN. Values that do not
+# parse as numbers in a numeric column become NaN as well.
+def apply_schema(data, dtypes):
+    converted = {}
+    for col, dtype in dtypes.items():
+        if col not in data:
+            continue
+
+        column = data[col]
+        if column.dtype == object or pd.api.types.is_string_dtype(column):
+            column = column.where(~column.isin(MISSING))
+            if dtype not in _NON_NUMERIC:
+                column = pd.to_numeric(column, errors='coerce')
+        converted[col] = column.astype(dtype)
+
+    return data.assign(**converted)
+
+
+def read_rf_csv(path, **kwargs):
+    return pd.read_csv(path, index_col=False, dtype=RF_DTYPES, **kwargs)
+
+
+def memory_mb(data):
+    return data.memory_usage(deep=True).sum() / 2.0 ** 20
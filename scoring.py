@@ -0,0 +1,78 @@
+#######################################################
+# Scoring a batch of listings
+#
+# The ensemble is evaluated once per batch: the labels
+# are the argmax of the class probabilities (which is
+# all clf.predict does), and the confusion matrix and
+# AUC are computed from the same probabilities.
+#######################################################
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from sklearn.metrics import confusion_matrix, roc_auc_score
+
+
+# Wall time per named stage, in seconds, in the order the
+# stages ran
+class StageTimer(object):
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.time() - start
+
+    def total(self):
+        return sum(self.timings.values())
+
+    def __str__(self):
+        return ", ".join("%s %.1f ms" % (name, 1000 * seconds)
+                         for name, seconds in self.timings.items())
+
+
+# The features as float32, which is what the trees compare
+# against anyway. Missing values (pd.NA) become NaN, and a data
+# frame stays a data frame so its column names are kept.
+def as_features(X):
+    if hasattr(X, 'columns'):
+        return X.astype('float32')
+    return np.asarray(X, dtype=np.float32)
+
+
+# Scores X with clf in a single pass over the ensemble. Returns a
+# dict with the class probabilities, the predicted labels, and, if
+# the true labels y are given, the confusion matrix (over all of
+# clf's classes) and the ROC AUC of the second class (NaN when y
+# only has one class). The stage timings are added to timer.
+def score(clf, X, y=None, timer=None):
+    timer = timer if timer is not None else StageTimer()
+
+    with timer.stage('features'):
+        X = as_features(X)
+
+    with timer.stage('predict_proba'):
+        proba = clf.predict_proba(X)
+
+    with timer.stage('labels'):
+        labels = clf.classes_.take(np.argmax(proba, axis=1))
+
+    result = {'proba': proba, 'labels': labels, 'timer': timer}
+    if y is None:
+        return result
+
+    with timer.stage('metrics'):
+        y = np.asarray(y)
+        result['cmat'] = confusion_matrix(y, labels, labels=clf.classes_)
+        try:
+            result['auc'] = roc_auc_score(y, proba[:, 1], average="weighted")
+        except ValueError:
+            result['auc'] = float('nan')
+
+    return result
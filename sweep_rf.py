@@ -0,0 +1,243 @@
+#######################################################
+# Hyperparameter sweep for the random forest
+#
+# Runs a grid (or a random sample of the grid) of
+# RandomForestClassifier settings across a process
+# pool. The train/test split is written once as .npy
+# files that every worker memory-maps, instead of the
+# matrix being pickled to each worker. Each finished
+# setting is appended to a results CSV, and settings
+# already in it (for the same data) are skipped, so an
+# interrupted sweep picks up where it stopped, e.g.
+#
+#   python sweep_rf.py --workers 4 --random 20
+#######################################################
+
+from __future__ import print_function
+
+import csv
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import random
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, roc_auc_score
+
+try:
+    from sklearn.model_selection import train_test_split
+except ImportError:
+    from sklearn.cross_validation import train_test_split
+
+import schema
+
+DATA_PATH = "Data/ebay_data_rf.csv"
+SWEEP_DIR = "Data/sweep_rf"
+RESULTS_PATH = "Data/sweep_rf_results.csv"
+
+# The values tried for each parameter
+GRID = [('n_estimators', [100, 200, 300]),
+        ('max_features', ['sqrt', 7, 13, None]),
+        ('min_samples_leaf', [1, 5, 20]),
+        ('class_weight', [None, 'balanced'])]
+
+RESULT_COLUMNS = ['data', 'params', 'auc', 'accuracy', 'fit_time', 'predict_time',
+                  'model_bytes', 'n_nodes']
+
+
+def _file_hash(path, block_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+#######################################################
+# Settings
+#######################################################
+
+def grid_settings(grid=GRID):
+    names = [name for name, values in grid]
+    return [dict(zip(names, values))
+            for values in itertools.product(*[values for name, values in grid])]
+
+
+# n settings drawn from the grid without replacement
+def random_settings(n, seed=0, grid=GRID):
+    settings = grid_settings(grid)
+    return random.Random(seed).sample(settings, min(n, len(settings)))
+
+
+def settings_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+#######################################################
+# Shared training data
+#######################################################
+
+# Splits the training CSV as model_rf.py does and saves the four
+# arrays under sweep_dir/<hash of the CSV>. Returns that directory
+# and the hash; an existing split is reused.
+def prepare_data(path=DATA_PATH, sweep_dir=SWEEP_DIR, test_size=0.1, random_state=7):
+    digest = _file_hash(path)
+    data_dir = os.path.join(sweep_dir, digest)
+    if os.path.isfile(os.path.join(data_dir, 'y_test.npy')):
+        return data_dir, digest
+
+    data = schema.read_rf_csv(path)
+    y = data.pop('sellingState').values
+    X = data.values.astype(np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=random_state)
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    for name, array in [('X_train', X_train), ('X_test', X_test),
+                        ('y_train', y_train), ('y_test', y_test)]:
+        np.save(os.path.join(data_dir, name + '.npy'), np.ascontiguousarray(array))
+
+    return data_dir, digest
+
+
+# The memory-mapped arrays of each data directory, per process
+_arrays = {}
+
+
+def _load_data(data_dir):
+    if data_dir not in _arrays:
+        _arrays[data_dir] = dict((name, np.load(os.path.join(data_dir, name + '.npy'),
+                                                mmap_mode='r'))
+                                 for name in ['X_train', 'X_test', 'y_train', 'y_test'])
+    return _arrays[data_dir]
+
+
+#######################################################
+# Running the sweep
+#######################################################
+
+# Fits and scores one setting (in a worker process)
+def evaluate(task):
+    data_dir, digest, params = task
+    data = _load_data(data_dir)
+
+    clf = RandomForestClassifier(n_jobs=1, random_state=7, **params)
+
+    start = time.time()
+    clf.fit(data['X_train'], data['y_train'])
+    fit_time = time.time() - start
+
+    start = time.time()
+    proba = clf.predict_proba(data['X_test'])
+    predict_time = time.time() - start
+
+    labels = clf.classes_.take(np.argmax(proba, axis=1))
+
+    return {'data': digest,
+            'params': settings_key(params),
+            'auc': roc_auc_score(data['y_test'], proba[:, 1]),
+            'accuracy': accuracy_score(data['y_test'], labels),
+            'fit_time': fit_time,
+            'predict_time': predict_time,
+            'model_bytes': len(pickle.dumps(clf, protocol=2)),
+            'n_nodes': sum(tree.tree_.node_count for tree in clf.estimators_)}
+
+
+# The keys of the settings already in the results for this data
+def finished_settings(results_path, digest):
+    if not os.path.isfile(results_path):
+        return set()
+    with open(results_path) as fin:
+        return set(row['params'] for row in csv.DictReader(fin) if row['data'] == digest)
+
+
+def _append_result(results_path, result):
+    new_file = not os.path.isfile(results_path)
+    with open(results_path, 'a') as fout:
+        writer = csv.DictWriter(fout, RESULT_COLUMNS, lineterminator='\n')
+        if new_file:
+            writer.writeheader()
+        writer.writerow(result)
+
+
+# Runs the settings not in results_path yet on n_workers processes,
+# appending each result as it finishes. Returns the new results.
+def run_sweep(settings, data_dir, digest, results_path=RESULTS_PATH, n_workers=1):
+    done = finished_settings(results_path, digest)
+    tasks = [(data_dir, digest, params) for params in settings
+             if settings_key(params) not in done]
+    print(len(settings) - len(tasks), "of", len(settings), "settings already done")
+
+    results = []
+    if not tasks:
+        return results
+
+    pool = Pool(n_workers)
+    try:
+        for result in pool.imap_unordered(evaluate, tasks):
+            _append_result(results_path, result)
+            results.append(result)
+            print("%d/%d  AUC %.4f  fit %6.1f s  %s"
+                  % (len(results), len(tasks), result['auc'], result['fit_time'],
+                     result['params']))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print("Interrupted; run again to resume.")
+    except BaseException:
+        # A setting failed in its worker: stop the others, so that
+        # the join below returns and the worker's error is raised
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+#######################################################
+# Main
+#######################################################
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-d", "--data",
+                      dest="data", default=DATA_PATH,
+                      help="The training data written by preproc_rf.py.")
+    parser.add_option("-o", "--results",
+                      dest="results", default=RESULTS_PATH,
+                      help="The results CSV, which is appended to.")
+    parser.add_option("-w", "--workers",
+                      dest="workers", type="int", default=1,
+                      help="The number of processes that fit forests.")
+    parser.add_option("-r", "--random",
+                      dest="random", type="int", default=None,
+                      help="Try this many random settings instead of the whole grid.")
+    parser.add_option("--seed",
+                      dest="seed", type="int", default=0,
+                      help="The seed of the random search.")
+    (opts, args) = parser.parse_args()
+
+    if opts.random:
+        settings = random_settings(opts.random, opts.seed)
+    else:
+        settings = grid_settings()
+
+    print("Preparing the data...")
+    data_dir, digest = prepare_data(opts.data)
+
+    run_sweep(settings, data_dir, digest, opts.results, opts.workers)
+
+    if os.path.isfile(opts.results):
+        import pandas as pd
+        results = pd.read_csv(opts.results)
+        results = results[results.data == digest].sort_values('auc', ascending=False)
+        print(results[['params', 'auc', 'accuracy', 'fit_time', 'predict_time',
+                       'model_bytes']].head(10).to_string(index=False))
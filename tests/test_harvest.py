@@ -0,0 +1,105 @@
+#######################################################
+# Request counts of the harvest against the local
+# Finding API stub (finding_stub.py): every window's
+# first page is requested exactly once.
+#######################################################
+
+import os
+from collections import Counter
+from math import ceil
+
+import pytest
+
+import ebay
+import finding_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+END_TIME = finding_stub.NEWEST.strftime(finding_stub.TIME_FORMAT)
+
+
+@pytest.fixture
+def stub():
+    server = finding_stub.serve()
+    yield server
+    server.shutdown()
+
+
+# Options pointing at the stub, with the end of the range pinned
+# and no call budget file
+def stub_opts(server, n_items, workers=4):
+    server.data = finding_stub.StubData(n_items)
+    opts, args = ebay.init_options(['--domain', server.domain, '--no-https',
+                                    '--appid', 'stub', '--yaml', os.path.join(ROOT, 'ebay.yaml'),
+                                    '--workers', str(workers), '--daily-limit', '0',
+                                    '--end-time', END_TIME, '--quiet'])
+    return opts
+
+
+# The number of requests for each (page, EndTimeFrom, EndTimeTo)
+def request_counts(server):
+    return Counter(server.requests)
+
+
+def first_page_counts(server):
+    return [count for (page, end_from, end_to), count in request_counts(server).items()
+            if page == 1]
+
+
+def test_get_all_100_requests_each_page_once(stub):
+    opts = stub_opts(stub, 2500)
+    data = ebay.get_all_100(opts, ebay.get_api_dict())
+
+    assert len(data) == 2500
+    assert stub.n_requests == 25
+    assert ebay.get_request_count(opts) == 25
+    assert set(request_counts(stub).values()) == set([1])
+
+
+def test_get_all_requests_first_pages_once(stub):
+    opts = stub_opts(stub, 2500)
+    data = ebay.get_all(opts, ebay.get_api_dict())
+
+    assert len(data) == 2500
+    assert stub.n_requests == 25
+    assert first_page_counts(stub) == [1]
+
+
+def test_get_all_chained_calls(stub):
+    # 105 pages take two 100-page calls, each over its own window
+    opts = stub_opts(stub, 10500)
+    data = ebay.get_all(opts, ebay.get_api_dict())
+
+    assert data.itemId.nunique() == 10500
+    assert first_page_counts(stub) == [1, 1]
+    assert set(request_counts(stub).values()) == set([1])
+    assert stub.n_requests == 100 + int(ceil((10500 - 10000 + 1) / 100.0))
+
+
+def test_get_new_requests_first_page_once(stub):
+    opts = stub_opts(stub, 2500)
+    newest = [finding_stub.make_item(i) for i in range(301)]
+    mark = {'endTime': newest[-1]['listingInfo']['endTime'],
+            'itemId': newest[-1]['itemId']}
+
+    data = ebay.get_new(opts, ebay.get_api_dict(), mark)
+
+    # EndTimeFrom is inclusive: the listing at the mark is fetched
+    # and dropped
+    assert sorted(data.itemId.astype(str)) == sorted(item['itemId'] for item in newest[:-1])
+    assert first_page_counts(stub) == [1]
+    assert stub.n_requests == 4
+
+
+def test_plan_windows_raises_when_a_probe_fails(stub, monkeypatch):
+    opts = stub_opts(stub, 2500)
+    fetch_pages = ebay._fetch_pages
+
+    # The probe of the last window fails even after the retries
+    def failing_fetch_pages(opts, fetch_page, tasks, verbose=None):
+        pages = fetch_pages(opts, fetch_page, tasks, verbose)
+        return pages[:-1] + [None]
+
+    monkeypatch.setattr(ebay, '_fetch_pages', failing_fetch_pages)
+    with pytest.raises(ebay.fetcher.FetchError):
+        ebay.plan_windows(opts, ebay.get_api_dict(), '2015-01-01T00:00:00.000Z', END_TIME, 4)
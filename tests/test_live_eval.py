@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from live_eval import SeenItems, WindowEvaluator
+
+
+def test_seen_items_are_only_marked_by_add():
+    seen = SeenItems(max_size=3)
+    assert seen.new_mask(['a', 'b']).tolist() == [True, True]
+    assert seen.new_mask(['a', 'b']).tolist() == [True, True]
+
+    seen.add(['a', 'b', 'c', 'd'])
+    assert seen.new_mask(['a', 'b', 'd', 'e']).tolist() == [True, False, False, True]
+
+
+def test_window_evaluator_drops_unknown_labels():
+    evaluator = WindowEvaluator()
+    evaluator.add(datetime(2016, 5, 4), y=[0, 1, -1, 1], labels=[0, 1, 0, 0], scores=[0.1, 0.9, 0.2, 0.4])
+
+    assert evaluator.count() == 3
+    assert evaluator.cmat.tolist() == [[1, 0], [1, 1]]
+    assert evaluator.auc() == 1.0
@@ -0,0 +1,213 @@
+#######################################################
+# The pipelined live scorer: LivePipeline on its own,
+# and clock.make_pipeline with a stubbed page function,
+# a small fitted forest and its encoder.
+#######################################################
+
+import threading
+import time
+
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import ebay
+import finding_stub
+import model_registry
+from live_eval import SeenItems, WindowEvaluator
+from live_pipeline import LivePipeline
+from metrics_store import MetricsStore
+from preproc_rf import CategoricalEncoder, preproc_rf
+
+
+# A fetch stage that blocks each tick until release() is called
+class BlockingFetch(object):
+    def __init__(self):
+        self.started = threading.Semaphore(0)
+        self.released = threading.Semaphore(0)
+        self.timestamps = []
+
+    def __call__(self, timestamp):
+        self.timestamps.append(timestamp)
+        self.started.release()
+        self.released.acquire()
+        return timestamp
+
+    def release(self, n=1):
+        for _ in range(n):
+            self.released.release()
+
+
+def test_ticks_are_coalesced_while_fetch_is_busy():
+    fetch = BlockingFetch()
+    published = []
+    pipeline = LivePipeline(fetch, lambda t, data: data,
+                            lambda t, result: published.append(result)).start()
+
+    assert pipeline.tick(1)
+    assert fetch.started.acquire(timeout=5)
+
+    # The fetch of tick 1 is running: tick 2 waits for it, and
+    # tick 3 is coalesced into tick 2
+    assert pipeline.tick(2)
+    assert not pipeline.tick(3)
+
+    fetch.release(2)
+    pipeline.stop(5)
+
+    assert fetch.timestamps == [1, 2]
+    assert published == [1, 2]
+    assert pipeline.counters == {'ticks': 3, 'coalesced': 1, 'empty': 0,
+                                 'errors': 0, 'published': 2}
+
+
+# Waits until the pipeline has been through n ticks (published,
+# empty or failed)
+def _wait_done(pipeline, n, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        counters = pipeline.summary()['counters']
+        if counters['published'] + counters['empty'] + counters['errors'] >= n:
+            return
+        time.sleep(0.001)
+    raise AssertionError("the pipeline did not get through %d ticks" % n)
+
+
+def test_empty_and_failing_ticks_are_dropped():
+    results = {1: 'a', 2: None, 3: 'c', 4: 'd'}
+    published = []
+
+    def score(timestamp, data):
+        if data == 'c':
+            raise ValueError("bad batch")
+        if data == 'd':
+            return None
+        return data
+
+    pipeline = LivePipeline(lambda t: results[t], score,
+                            lambda t, result: published.append(result)).start()
+    for timestamp in [1, 2, 3, 4]:
+        pipeline.tick(timestamp)
+        _wait_done(pipeline, timestamp)
+    pipeline.stop(5)
+
+    assert published == ['a']
+    assert pipeline.counters['empty'] == 2
+    assert pipeline.counters['errors'] == 1
+
+
+def test_stop_drains_the_queues(tmpdir):
+    published = []
+    latency_path = str(tmpdir.join('latency.json'))
+    pipeline = LivePipeline(lambda t: t, lambda t, data: data,
+                            lambda t, result: published.append(result),
+                            latency_path=latency_path).start()
+
+    n_requested = sum(pipeline.tick(t) for t in range(50))
+    pipeline.stop(5)
+
+    assert not any(thread.is_alive() for thread in pipeline._threads)
+    assert len(published) == n_requested == pipeline.counters['published']
+    assert pipeline.summary()['latency']['total']['count'] == n_requested
+    assert tmpdir.join('latency.json').check()
+
+
+#######################################################
+# clock.make_pipeline
+#######################################################
+
+# The page of the i-th to (i + n)-th newest stub listings
+def stub_page(start, n=100):
+    return {'ack': 'Success',
+            'searchResult': {'item': [finding_stub.make_item(i)
+                                      for i in range(start, start + n)]}}
+
+
+def _listings(page):
+    return ebay.preproc(ebay._get_relevant_data(page['searchResult']['item']))
+
+
+@pytest.fixture
+def clock(monkeypatch, tmpdir):
+    try:
+        import clock
+    except ImportError as e:
+        pytest.skip("clock.py cannot be imported: %s" % e)
+
+    # A forest and encoder fitted on stub listings
+    data = _listings(stub_page(1000, 500))
+    encoder = CategoricalEncoder().fit(data)
+    data = preproc_rf(data, encoder)
+    y = data.pop('sellingState')
+    data.drop(['endTime'], axis=1, inplace=True)
+    clf = RandomForestClassifier(10, random_state=0).fit(data.astype('float32'), y)
+
+    monkeypatch.setattr('sys.argv', ['clock.py'])
+    monkeypatch.setattr(model_registry, 'get_model', lambda path=None, n_rows=None: clf)
+    monkeypatch.setattr(clock, 'get_encoder', lambda: encoder)
+    monkeypatch.setattr(clock, '_metrics', [MetricsStore(str(tmpdir.join('running_data.csv')))])
+    monkeypatch.setattr(clock, 'seen_items', SeenItems())
+    monkeypatch.setattr(clock, 'evaluator', WindowEvaluator())
+    monkeypatch.setattr(clock, 'make_plots', lambda: None)
+    return clock
+
+
+def test_clock_pipeline_with_stub_pages(clock, tmpdir):
+    # Tick 2 sees the same listings as tick 1 and has nothing to
+    # score; tick 3 blocks until the test lets it through
+    pages = [stub_page(0), stub_page(0), stub_page(50)]
+    blocked, release = threading.Event(), threading.Event()
+
+    def get_page(opts, api_request, page_number=1):
+        if len(pages) == 1:
+            blocked.set()
+            release.wait(5)
+        return pages.pop(0)
+
+    pipeline = clock.make_pipeline(get_page, latency_path=str(tmpdir.join('latency.json')))
+    pipeline.start()
+
+    for n in [1, 2]:
+        assert pipeline.tick()
+        _wait_done(pipeline, n)
+
+    assert pipeline.tick()
+    assert blocked.wait(5)
+    assert pipeline.tick()
+    assert not pipeline.tick()
+
+    # Tick 4 finds no page left, which fails its fetch
+    release.set()
+    pipeline.stop(10)
+
+    assert pipeline.counters == {'ticks': 5, 'coalesced': 1, 'empty': 1,
+                                 'errors': 1, 'published': 2}
+    assert len(clock.get_metrics().frame()) == 2
+    assert clock.evaluator.count() == 150
+    assert len(clock.seen_items) == 150
+
+
+def test_clock_rescores_a_failed_tick(clock, monkeypatch, tmpdir):
+    clf = model_registry.get_model()
+    calls = []
+
+    def get_model(path=None, n_rows=None):
+        calls.append(n_rows)
+        if len(calls) == 1:
+            raise IOError("model file is being replaced")
+        return clf
+
+    monkeypatch.setattr(model_registry, 'get_model', get_model)
+    pipeline = clock.make_pipeline(lambda opts, api_request: stub_page(0), latency_path=None)
+    pipeline.start()
+
+    # The scoring of tick 1 fails, so tick 2 scores the same listings
+    for n in [1, 2, 3]:
+        pipeline.tick()
+        _wait_done(pipeline, n)
+    pipeline.stop(5)
+
+    assert calls == [100, 100]
+    assert pipeline.counters['errors'] == 1
+    assert pipeline.counters['published'] == 1
+    assert pipeline.counters['empty'] == 1
+    assert clock.evaluator.count() == 100
@@ -0,0 +1,34 @@
+#######################################################
+# Redundant column detection of preproc_rf.py
+#######################################################
+
+import numpy as np
+import pandas as pd
+
+from preproc_rf import find_redundant_cols
+
+
+def test_duplicates_are_found_across_dtypes():
+    values = [0, 1, 0, 1]
+    data = pd.DataFrame({'codes': np.array(values, dtype='int16'),
+                         'hour': np.array(values, dtype='int8'),
+                         'score': np.array(values, dtype='float32'),
+                         'count': np.array(values, dtype='int64'),
+                         'flag': pd.array([False, True, False, True], dtype='boolean'),
+                         'other': np.array([1, 0, 1, 0], dtype='int16'),
+                         'zeros': np.zeros(4, dtype='int8')})
+
+    constant, duplicate = find_redundant_cols(data)
+
+    assert constant == ['zeros']
+    assert duplicate == ['hour', 'score', 'count', 'flag']
+
+
+def test_missing_values_match_missing_values():
+    data = pd.DataFrame({'a': pd.array([1, None, 2, 1], dtype='Int32'),
+                         'b': [1.0, np.nan, 2.0, 1.0],
+                         'c': ['x', None, 'y', 'x'],
+                         'd': pd.Series(['x', None, 'y', 'x'], dtype='category'),
+                         'e': [1.0, 2.0, np.nan, 1.0]})
+
+    assert find_redundant_cols(data) == ([], ['b', 'd'])
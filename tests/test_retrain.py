@@ -0,0 +1,88 @@
+#######################################################
+# Drift-triggered retraining against the local Finding
+# API stub: retrain harvests the new listings itself and
+# extends the encoder without changing the old codes.
+#######################################################
+
+import os
+from datetime import datetime, timedelta
+
+import joblib
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import ebay
+import finding_stub
+import retrain_rf
+from listing_store import ListingStore
+from preproc_rf import CategoricalEncoder, INPUT_COLUMNS, preproc_rf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def stub():
+    server = finding_stub.serve(n_items=3200)
+    yield server
+    server.shutdown()
+
+
+# A forest and encoder fitted on 100 old stub listings (ended more
+# than a day before the newest), which are also in the store
+@pytest.fixture
+def model(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.mkdir('Data')
+
+    items = [finding_stub.make_item(i) for i in range(3000, 3100)]
+    store = ListingStore()
+    store.upsert(ebay.preproc(ebay._get_relevant_data(items)))
+    data = store.read(INPUT_COLUMNS)
+    store.close()
+
+    # Only half of the products are known to the encoder
+    data = data[data.productId_value.isnull() | (data.productId_value.astype(float) % 50 < 25)]
+    encoder = CategoricalEncoder().fit(data)
+    data = preproc_rf(data, encoder)
+    y = data.pop('sellingState')
+    data = data.drop(['endTime'], axis=1)
+    clf = RandomForestClassifier(20, random_state=0).fit(data.astype('float32'), y)
+
+    model_path, encoder_path = str(tmpdir.join('rf.pkl')), str(tmpdir.join('encoder.json'))
+    joblib.dump(clf, model_path)
+    encoder.save(encoder_path)
+    return model_path, encoder_path
+
+
+def test_retrain_harvests_and_extends_the_encoder(stub, model):
+    model_path, encoder_path = model
+    opts, args = ebay.init_options(['--domain', stub.domain, '--no-https', '--appid', 'stub',
+                                    '--yaml', os.path.join(ROOT, 'ebay.yaml'),
+                                    '--daily-limit', '0', '--quiet'])
+    old_vocabulary = CategoricalEncoder.load(encoder_path).vocabulary
+
+    # The window reaches back one day before the newest stub listing
+    window = datetime.utcnow() - finding_stub.NEWEST + timedelta(days=1)
+    n_fitted = retrain_rf.retrain(model_path, window, n_new=10, n_retire=10,
+                                  encoder_path=encoder_path, opts=opts)
+
+    # The store was last harvested before the window, so the whole
+    # window (1441 listings, 60 s apart) was fetched
+    assert n_fitted == 24 * 60 + 1
+    assert ListingStore().count() == 100 + n_fitted
+
+    vocabulary = CategoricalEncoder.load(encoder_path).vocabulary
+    for feat, values in old_vocabulary.items():
+        assert vocabulary[feat][:len(values)] == values
+    assert len(vocabulary['productId_value']) == len(set(vocabulary['productId_value'])) == 51
+
+    clf = joblib.load(model_path)
+    assert len(clf.estimators_) == 20
+
+    # The next retrain only fetches what ended after the newest
+    # listing in the store: nothing
+    n_requests = stub.n_requests
+    retrain_rf.retrain(model_path, window, n_new=10, n_retire=10,
+                       encoder_path=encoder_path, opts=opts)
+    assert stub.n_requests == n_requests + 1
+    assert ListingStore().count() == 100 + n_fitted